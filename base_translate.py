@@ -1,24 +1,458 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import time
 import argparse
+import threading
+import daemon_client
+import progressive
+import supersede
+import translation_cache
 from google_translate import GoogleTranslate
 from msft_translate import MicrosoftTranslate
 
-from workflow import Workflow, ICON_WARNING, PasswordNotFound
+from workflow import (Workflow, Workflow3, ICON_SYNC, ICON_WARNING,
+                      PasswordNotFound)
 
 GOOGL_API = 'GOOGL'
 MSFT_API = 'MSFT'
+BOTH_API = 'BOTH'
+FANOUT_TIMEOUT = 5  # in sec.
+WARM_JOBS = 4  # requests in flight during `--warm`
+WARM_CHUNK = 100  # texts per request during `--warm`
 WF_UPDATE_FREQUENCY = 3  # in days
 GITHUB_SLUG = 'pbojkov/alfred-workflow-google-translate'
+UPDATE_SETTINGS = {
+    'github_slug': GITHUB_SLUG,
+    'frequency': WF_UPDATE_FREQUENCY
+}
+# Touched whenever an update check is started.
+UPDATE_MARKER = 'update_check'
 
+# Generation of the query being translated (see `supersede`), None if
+# not a plain query.
+generation = None
+# Set by the daemon: fetch results for `progressive` in a thread, not in
+# a background process.
+fetch_in_thread = False
 
-def main(wf):
-    if wf.update_available:
-        # Download new version and tell Alfred to install it
-        wf.start_update()
 
+def lookup(apis, lines):
+    """Translations of ``lines`` already in the cache, for each of
+    ``apis``. Only touches the cache: no API keys, tokens or network.
+
+        Returns:
+            A list of cached translation dictionaries and a list of the
+            APIs that missed.
+    """
+    translations = []
+    misses = []
+    for api in apis:
+        # Several lines are a hit only if all are cached: on a miss,
+        # `translate_many` looks them up again and fetches the rest.
+        cached = api.cached_translations(lines if len(lines) > 1 else None)
+        if cached is None:
+            misses.append(api)
+        else:
+            translations.extend(cached)
+    return translations, misses
+
+
+def fetch(api, lines):
+    """Translate ``lines`` with ``api`` after a cache miss: one request
+    for all lines.
+    """
+    if len(lines) > 1:
+        return api.translate_many(lines)
+    return api.fetch_translations()
+
+
+def translate_concurrently(apis, lines, timeout=FANOUT_TIMEOUT,
+                           on_result=None):
+    """Translate ``lines`` with several APIs (or target languages) at once.
+
+    The APIs are queried in parallel threads, and their results are
+    collected as they arrive until all are in or ``timeout`` seconds have
+    passed (None: until all are in). An API that fails or is too slow is
+    logged and left out. ``on_result`` is called with the translations
+    of each API as soon as they arrive.
+
+        Returns:
+            A list of translation dictionaries and a list of the errors
+            of the APIs that failed.
+    """
+    import Queue
+    translations = []
+    errors = []
+    pending = list(apis)
+
+    def worker(api):
+        try:
+            results.put((api, fetch(api, lines), None))
+        except Exception as e:
+            results.put((api, None, e))
+
+    results = Queue.Queue()
+    for api in pending:
+        thread = threading.Thread(target=worker, args=(api,))
+        thread.daemon = True  # don't wait for it on exit
+        thread.start()
+
+    deadline = None if timeout is None else time.time() + timeout
+    for _ in pending:
+        try:
+            api, trans, error = results.get(
+                timeout=None if deadline is None
+                else max(deadline - time.time(), 0))
+        except Queue.Empty:
+            log.warning('Translation timed out after {0}s'.format(timeout))
+            break
+        if isinstance(error, PasswordNotFound):
+            log.debug('No API key for {0}'.format(type(api).__name__))
+            errors.append(error)
+        elif error:
+            log.error('{0} failed: {1}'.format(type(api).__name__, error))
+            errors.append(error)
+        else:
+            translations.extend(trans)
+            if on_result is not None:
+                on_result(trans)
+    return translations, errors
+
+
+def is_network_error(error):
+    """Whether ``error`` means a translation service can't be reached.
+
+    The network modules are only imported (by the translators) when a
+    query isn't cached, so they are imported here only on error, too.
+    """
+    import socket
+    from urllib2 import URLError
+    return isinstance(error, (URLError, socket.error))
+
+
+def suggest(apis, limit=translation_cache.MAX_SUGGESTIONS):
+    """Past translations of queries similar to the query of ``apis``,
+    from the translation memory.
+
+        Returns:
+            A list of translation dictionaries, most similar first.
+    """
+    suggestions = []
+    for api in apis:
+        suggestions.extend(api.suggestions())
+    suggestions.sort(key=lambda tr: tr['similarity'], reverse=True)
+    return suggestions[:limit]
+
+
+def item(tr):
+    """Feedback item (``Workflow.add_item`` arguments) of translation
+    dictionary ``tr``.
+    """
+    return {'title': tr['title'],
+            'subtitle': tr['subtitle'],
+            'valid': tr['valid'],
+            'arg': tr['arg'],
+            'copytext': tr['copytext'],
+            'largetext': tr['largetext'],
+            'quicklookurl': tr['quicklookurl'],
+            'icon': tr['icon']}
+
+
+def notice(title, subtitle):
+    """Feedback item telling the user about a problem."""
+    return {'title': title, 'subtitle': subtitle, 'valid': False,
+            'icon': ICON_WARNING}
+
+
+def final_items(apis, lines, translations, misses, generation=None,
+                timeout=FANOUT_TIMEOUT, on_result=None):
+    """Feedback items for ``lines``: the ``translations`` found by
+    :func:`lookup`, and those of ``misses`` from the network. Falls back
+    to :func:`suggest` when offline. ``timeout`` and ``on_result`` are
+    passed on to :func:`translate_concurrently`.
+
+    Raises :class:`supersede.Superseded` when the user has typed on.
+
+        Returns:
+            A list of keyword arguments of ``Workflow.add_item``.
+    """
+    error = None
+    try:
+        if len(apis) > 1 and misses:
+            fetched, errors = supersede.call(
+                generation, translate_concurrently, misses, lines, timeout,
+                on_result)
+            translations = translations + fetched
+            if not translations and errors and all(
+                    isinstance(e, PasswordNotFound) for e in errors):
+                raise errors[0]
+        elif misses:
+            translations = supersede.call(generation, fetch, misses[0],
+                                          lines)
+    except PasswordNotFound:
+        return [notice('No API key set.',
+                       'Type "tr-setkey" to set your API key.')]
+    except supersede.Superseded:
+        raise
+    except Exception as e:
+        if not is_network_error(e):
+            raise
+        log.error(e)
+        translations = []
+        error = e
+
+    items = []
+    # Offline: show what similar queries were translated to.
+    if not translations and len(lines) == 1:
+        translations = suggest(apis)
+        if translations:
+            items.append(notice('Translation service unavailable.',
+                                'Showing past translations of similar '
+                                'text.'))
+
+    if error and not translations:
+        raise error
+    if len(apis) > 1 and not translations:
+        items.append(notice('No translation available.',
+                            'All translation services failed or timed '
+                            'out.'))
+    items.extend(item(tr) for tr in translations)
+    return items
+
+
+def fetch_result(wf, key, apis, lines, generation):
+    """Worker of :mod:`progressive`: translate ``lines`` and deliver the
+    feedback items as the result of ``key``. With several APIs, each
+    one's items are added as soon as they arrive, and the worker waits
+    for all of them: reruns show what's there.
+    """
+    def on_result(translations):
+        if translations and not supersede.is_superseded(generation):
+            progressive.add(wf, key, [item(tr) for tr in translations])
+
+    try:
+        translations, misses = lookup(apis, lines)
+        items = final_items(apis, lines, translations, misses, generation,
+                            timeout=None, on_result=on_result)
+    except supersede.Superseded as e:
+        log.debug(e)
+        progressive.discard(wf, key)
+    except Exception as e:
+        log.exception(e)
+        progressive.finish(wf, key, error=unicode(e))
+    else:
+        progressive.finish(wf, key, items)
+
+
+def start_fetch(wf, key, apis, lines):
+    """Start the worker fetching the result of ``key``: a thread in the
+    daemon, else ``base_translate.py --fetch`` in the background.
+    """
+    if fetch_in_thread:
+        def spawn():
+            thread = threading.Thread(
+                target=fetch_result,
+                args=(wf, key, apis, lines, generation))
+            thread.daemon = True
+            thread.start()
+    else:
+        def spawn():
+            import subprocess
+            with open(os.devnull, 'r+b') as devnull:
+                subprocess.Popen(
+                    ['/usr/bin/env', 'python',
+                     wf.workflowfile('base_translate.py'), '--fetch', key,
+                     str(generation or 0), apis[0].query.encode('utf-8')],
+                    cwd=wf.workflowdir, stdin=devnull, stdout=devnull,
+                    stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+    progressive.start(wf, key, spawn)
+
+
+def read_glossary(path):
+    """Terms of a word list or glossary for ``--warm``.
+
+    One term per line, or tab-separated: term, target languages (comma-
+    separated) and API (GOOGL, MSFT or BOTH). Empty fields fall back to
+    the current settings. Blank lines and lines starting with ``#`` are
+    skipped.
+
+        Arguments:
+            path: path to a UTF-8 text file
+
+        Returns:
+            A list of ``(term, langs, api)`` tuples, with None for
+            settings not overridden.
+    """
+    import io
+    entries = []
+    with io.open(path, encoding='utf-8') as file_obj:
+        for number, line in enumerate(file_obj, 1):
+            fields = [field.strip() for field in line.split(u'\t')]
+            if not fields[0] or fields[0].startswith(u'#'):
+                continue
+            fields += [u''] * (3 - len(fields))
+            langs = [lang.strip() for lang in fields[1].split(u',')
+                     if lang.strip()]
+            api = fields[2].upper() or None
+            if api not in (None, GOOGL_API, MSFT_API, BOTH_API):
+                raise ValueError('{0}:{1}: unknown API {2}'.format(
+                    path, number, api))
+            entries.append((fields[0], langs or None, api))
+    return entries
+
+
+def warm(wf, path, jobs=WARM_JOBS):
+    """Translate the terms in ``path`` (see :func:`read_glossary`) that
+    aren't cached yet, so looking them up later is a cache hit.
+
+    Requests of up to ``WARM_CHUNK`` terms are sent by ``jobs`` threads.
+    Progress goes to stderr. Every request's translations are cached as
+    soon as they arrive, so running it again after an interruption only
+    translates what is left. Terms for an API without a target language
+    (in the file or the settings) are skipped with a warning.
+
+        Returns:
+            The exit status: 0 if all terms could be translated.
+    """
+    import Queue
+    from collections import OrderedDict
+    translators = {GOOGL_API: GoogleTranslate, MSFT_API: MicrosoftTranslate}
+
+    groups = OrderedDict()  # terms by API and target language
+    skipped = OrderedDict()  # terms by API without a target language
+    for term, langs, api in read_glossary(path):
+        api = api or wf.settings.get('api', None)
+        if not api:
+            raise RuntimeError('No translation service (API) set. '
+                               'Type tr-setapi to set one.')
+        for name in [GOOGL_API, MSFT_API] if api == BOTH_API else [api]:
+            target_langs = langs or translators[name](wf).target_langs
+            if not target_langs:
+                skipped.setdefault(name, []).append(term)
+            for lang in target_langs:
+                groups.setdefault((name, lang), OrderedDict())[term] = True
+
+    sys.stderr.write('Cache directory: {0}\n'.format(wf.cachedir))
+    for name, skipped_terms in skipped.items():
+        log.warning('No {0} target language set: skipping {1} term(s). '
+                    'Type tr-setlang to set one, or add languages to the '
+                    'file.'.format(name, len(skipped_terms)))
+
+    tasks = Queue.Queue()
+    terms = todo = 0
+    for (name, lang), group in groups.items():
+        translator = translators[name](wf, target_lang=lang)
+        missing = translator.missing(list(group))
+        terms += len(group)
+        todo += len(missing)
+        for i in range(0, len(missing), WARM_CHUNK):
+            tasks.put((translator, missing[i:i + WARM_CHUNK]))
+
+    progress = {'done': 0, 'failed': 0}
+    progress_lock = threading.Lock()
+    end = '\r' if sys.stderr.isatty() else '\n'
+
+    def report():
+        sys.stderr.write('Warming cache: {0}/{1} translations, {2} '
+                         'failed{3}'.format(progress['done'], todo,
+                                            progress['failed'], end))
+        sys.stderr.flush()
+
+    def worker():
+        while not stop.is_set():
+            try:
+                translator, chunk = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                translator.prefetch(chunk)
+                failed = False
+            except PasswordNotFound:
+                log.error('No API key set for {0}'.format(
+                    type(translator).__name__))
+                failed = True
+            except Exception as e:
+                log.error('{0} ({1}) failed: {2}'.format(
+                    type(translator).__name__, translator.target_lang, e))
+                failed = True
+            with progress_lock:
+                progress['failed' if failed else 'done'] += len(chunk)
+                report()
+
+    log.info('Warming cache: {0} of {1} translations missing'.format(
+        todo, terms))
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(jobs, tasks.qsize()))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    def wait():
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.1)
+
+    try:
+        wait()
+    except KeyboardInterrupt:
+        # Cache what's in flight, then stop (a second Ctrl-C doesn't wait)
+        stop.set()
+        sys.stderr.write('\nInterrupted, finishing current requests...\n')
+        wait()
+        sys.stderr.write('\nRun again to resume.\n')
+        return 130
+
+    sys.stderr.write('{0}{1} translations cached, {2} were already, {3} '
+                     'failed.\n'.format('\n' if todo and end == '\r' else '',
+                                        progress['done'], terms - todo,
+                                        progress['failed']))
+    return 1 if progress['failed'] or skipped else 0
+
+
+def schedule_update(wf):
+    """Check for a new version of the workflow (and install it) in the
+    background, if the last check was more than ``WF_UPDATE_FREQUENCY``
+    days ago.
+
+    Not called for every keystroke: the daemon calls it after replying,
+    once a day, and ``base_translate.py`` only for the empty query Alfred
+    runs as soon as ``tr`` is typed. Costs one ``stat`` if no check is
+    due.
+    """
+    marker = wf.cachefile(UPDATE_MARKER)
+    try:
+        age = time.time() - os.stat(marker).st_mtime
+    except OSError:
+        age = None
+    if age is not None and age < WF_UPDATE_FREQUENCY * 60*60*24:
+        return
+    if not wf.settings.get('__workflow_autoupdate', True):
+        log.debug('Auto update turned off by user')
+        return
+
+    with open(marker, 'a'):
+        os.utime(marker, None)
+    from workflow.background import run_in_background
+    run_in_background('workflow_update', [
+        '/usr/bin/env', 'python', wf.workflowfile('base_translate.py'),
+        '--update'])
+
+
+def preconnect(wf):
+    """Open connections to the selected translation services, so the
+    first query doesn't wait for TCP and TLS handshakes.
+    """
+    saved_api = wf.settings.get('api', None)
+    if saved_api in (GOOGL_API, BOTH_API):
+        GoogleTranslate.preconnect()
+    if saved_api in (MSFT_API, BOTH_API):
+        MicrosoftTranslate.preconnect()
+
+
+def main(wf):
     parser = argparse.ArgumentParser()
     # Add an optional (nargs='?') --setkey argument and save its
     # value to 'api_key' (dest). This will be called from a separate "Run Script"
@@ -28,12 +462,41 @@ def main(wf):
     # API to be used for translations. Supported APIs: GOOGL and MSFT
     parser.add_argument('--setapi', dest='api', nargs='?', default='IGNORE')
 
+    # Fetch a cached translation again. Run in the background when a
+    # stale translation has been shown.
+    parser.add_argument('--refresh', dest='refresh', nargs=3, default=None,
+                        metavar=('API', 'LANG', 'QUERY'))
+
+    # Get a new Microsoft access token. Run in the background before
+    # the current one expires.
+    parser.add_argument('--refresh-token', dest='refresh_token',
+                        action='store_true')
+
+    # Look for a new version and install it. Run in the background by
+    # `schedule_update`.
+    parser.add_argument('--update', dest='update', action='store_true')
+
+    # Evict old translations from the cache. Run in the background by
+    # `translation_cache.schedule_gc`.
+    parser.add_argument('--gc', dest='gc', action='store_true')
+
+    # Translate the terms of a word list or glossary ahead of time.
+    parser.add_argument('--warm', dest='warm', metavar='FILE', default=None)
+
+    # Show how often translations come from the cache.
+    parser.add_argument('--stats', dest='stats', action='store_true')
+
+    # Translate the query and save the result for `progressive`. Run in
+    # the background by `start_fetch`.
+    parser.add_argument('--fetch', dest='fetch', nargs=2, default=None,
+                        metavar=('KEY', 'GENERATION'))
+
     # Add a query to be translated.
     parser.add_argument('query', nargs='?', default=None)
 
     args = parser.parse_args(wf.args)
 
-    if args.api and args.api in [GOOGL_API, MSFT_API]:
+    if args.api and args.api in [GOOGL_API, MSFT_API, BOTH_API]:
         wf.settings['api'] = args.api
         log.debug('*** Setting API to ' + args.api)
         return 0
@@ -49,6 +512,56 @@ def main(wf):
                     arg=MSFT_API,
                     valid=True,
                     icon=MicrosoftTranslate.get_icon())
+        wf.add_item('Google and Microsoft Translate.',
+                    'Select this to query both at the same time.',
+                    arg=BOTH_API,
+                    valid=True,
+                    icon=GoogleTranslate.get_icon())
+        wf.send_feedback()
+        return 0
+
+    if args.refresh:
+        api, lang, query = args.refresh
+        translator = {GOOGL_API: GoogleTranslate,
+                      MSFT_API: MicrosoftTranslate}[api]
+        translator(wf, query=query, target_lang=lang).refresh()
+        return 0
+
+    if args.refresh_token:
+        MicrosoftTranslate(wf).refresh_token()
+        return 0
+
+    if args.update:
+        # Download new version and tell Alfred to install it
+        Workflow(update_settings=UPDATE_SETTINGS).start_update()
+        return 0
+
+    if args.warm:
+        # `Workflow.run` ignores the return value
+        sys.exit(warm(wf, args.warm))
+
+    if args.gc:
+        start = time.time()
+        progressive.cleanup(wf)
+        reclaimed = translation_cache.open_store(wf).gc()
+        log.info('Cache GC: evicted {0} translations ({1} KB) in '
+                 '{2:.0f} ms'.format(reclaimed['entries'],
+                                     reclaimed['bytes'] // 1024,
+                                     (time.time() - start) * 1000))
+        return 0
+
+    if args.stats:
+        stats = translation_cache.open_store(wf).stats()
+        hits = stats['hits'] + stats['legacy_hits'] + stats['stale_hits']
+        lookups = hits + stats['misses']
+        wf.add_item('Cache hit rate: {0:.0%}'.format(
+                        float(hits) / lookups if lookups else 0),
+                    '{0} hits ({1} stale), {2} misses. {3} translations '
+                    'cached ({4} KB), {5} evicted ({6} KB).'.format(
+                        hits, stats['stale_hits'], stats['misses'],
+                        stats['entries'], stats['bytes'] // 1024,
+                        stats['gc_entries'], stats['gc_bytes'] // 1024),
+                    valid=False)
         wf.send_feedback()
         return 0
 
@@ -63,30 +576,30 @@ def main(wf):
 
     saved_api = wf.settings.get('api', None)
     if saved_api == GOOGL_API:
-        api = GoogleTranslate(wf)
+        apis = [GoogleTranslate(wf)]
     elif saved_api == MSFT_API:
-        api = MicrosoftTranslate(wf)
+        apis = [MicrosoftTranslate(wf)]
+    elif saved_api == BOTH_API:
+        apis = [GoogleTranslate(wf), MicrosoftTranslate(wf)]
     else:
         raise RuntimeError("Invalid translation API: " + saved_api)
 
     """Save the API key, if passed as argument."""
     if args.api_key:
-        api.api_key = args.api_key
-        return 0
-
-    """Ensure we have an API key stored."""
-    try:
-        api.api_key
-    except PasswordNotFound:
-        wf.add_item('No API key set.',
-                    'Type "tr-setkey" to set your API key.',
-                    valid=False,
-                    icon=ICON_WARNING)
-        wf.send_feedback()
+        if len(apis) > 1:
+            raise RuntimeError('Select Google or Microsoft with tr-setapi '
+                               'before setting an API key.')
+        apis[0].api_key = args.api_key
+        # Don't let a running daemon keep using the old key.
+        daemon_client.reset()
         return 0
 
     """Ensure we have a target language set."""
-    if not api.target_lang:
+    # One API object per target language, all translated concurrently.
+    apis = [type(provider)(wf, target_lang=target_lang)
+            for provider in apis
+            for target_lang in provider.target_langs]
+    if not apis:
         wf.add_item('No target language set.',
                     'Type tr-setlang to set a language to translate to.',
                     valid=False,
@@ -94,31 +607,109 @@ def main(wf):
         wf.send_feedback()
         return 0
 
-    # Get query from Alfred
+    # Get query from Alfred. It is empty when only `tr` has been typed
+    # (see `preconnect`).
     if not args.query:
-        raise RuntimeError("Expecting query as argument!")
-
-    api.query = args.query
-    translations = api.get_translations()
-
-    for tr in translations:
-        wf.add_item(title=tr['title'],
-                    subtitle=tr['subtitle'],
-                    valid=tr['valid'],
-                    arg=tr['arg'],
-                    copytext=tr['copytext'],
-                    largetext=tr['largetext'],
-                    quicklookurl=tr['quicklookurl'],
-                    icon=tr['icon'])
-
-    # Send output to Alfred as XML.
+        wf.add_item('Type a word or phrase to translate it.', valid=False)
+        wf.send_feedback()
+        return 0
+
+    # Several lines are translated in one request, one item per line.
+    lines = [line.strip() for line in args.query.splitlines()
+             if line.strip()]
+    for api in apis:
+        api.query = args.query
+        api.generation = generation
+
+    if args.fetch:
+        key, fetch_generation = args.fetch
+        for api in apis:
+            api.generation = int(fetch_generation) or None
+        fetch_result(wf, key, apis, lines, int(fetch_generation) or None)
+        return 0
+
+    # Cache first: API keys, access tokens and the network are only
+    # needed for what isn't cached.
+    translations, misses = lookup(apis, lines)
+
+    if misses and wf.settings.get(progressive.PROPS['ENABLED'], True):
+        key = progressive.result_key(apis, args.query)
+        record = progressive.status(wf, key)
+        if record is None:
+            try:
+                start_fetch(wf, key, apis, lines)
+                record = {}
+            except OSError as e:
+                log.error('Cannot fetch in the background: {0}'.format(e))
+        if record is not None and 'error' in record:
+            progressive.discard(wf, key)
+            raise RuntimeError(record['error'])
+        if record is not None and 'items' in record:
+            progressive.discard(wf, key)
+            for kwargs in record['items']:
+                wf.add_item(**kwargs)
+            wf.send_feedback()
+            return 0
+        if record is not None:
+            # What's at hand until the worker is done. Services that
+            # have delivered are cached by now, too.
+            shown = [item(tr) for tr in translations]
+            shown.extend(kwargs for kwargs in record.get('partial', [])
+                         if kwargs not in shown)
+            for kwargs in shown:
+                wf.add_item(**kwargs)
+            wf.add_item('Translating...', args.query, valid=False,
+                        icon=ICON_SYNC)
+            if len(lines) == 1:
+                for tr in suggest(misses):
+                    wf.add_item(**item(tr))
+            wf.rerun = progressive.RERUN_INTERVAL
+            wf.setvar(progressive.VARIABLE,
+                      progressive.pending_key(args.query))
+            wf.send_feedback()
+            return 0
+
+    # Give up as soon as the user has typed on, without any output.
+    try:
+        items = final_items(apis, lines, translations, misses, generation)
+    except supersede.Superseded as e:
+        log.debug(e)
+        return 0
+    for kwargs in items:
+        wf.add_item(**kwargs)
+
+    # Send output to Alfred.
     wf.send_feedback()
 
-if __name__ == '__main__':
-    wf = Workflow(update_settings={
-        'github_slug': GITHUB_SLUG,
-        'frequency': WF_UPDATE_FREQUENCY
-    })
+
+def run(query_generation=None):
+    """Run the workflow in-process with the command line in ``sys.argv``.
+
+    ``tr.py`` calls it when the daemon isn't running, with the
+    ``query_generation`` it registered (see :mod:`supersede`).
+
+        Returns:
+            Exit status.
+    """
+    global generation, log
+    generation = query_generation
+    # Only magic arguments (workflow:update etc.) need the update
+    # settings: with them, `Workflow.run` checks for updates on every
+    # keystroke. See `schedule_update` instead.
+    magic = any('workflow:' in arg for arg in sys.argv[1:])
+    wf = Workflow3(update_settings=UPDATE_SETTINGS if magic else None)
     # Assign Workflow logger to a global variable for convenience
     log = wf.logger
-    sys.exit(wf.run(main))
+    status = wf.run(main)
+
+    if sys.argv[1:] == ['']:
+        schedule_update(wf)
+    # Start the daemon so the next keystroke doesn't pay for startup.
+    if daemon_client.is_query(sys.argv[1:]):
+        translation_cache.schedule_gc(wf)
+        daemon_client.start(wf)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Import-time budget for the cache-hit path.
+
+Runs ``base_translate.main()`` for a cached query in fresh Python
+processes (set up as by ``keystroke.py``) and checks that
+
+    - importing ``base_translate`` takes at most ``--budget`` ms
+      (median), and
+    - none of the modules only needed to go to the network (or for
+      rarely used features) has been imported by the end of the run.
+
+Exits with status 1 if the budget is exceeded.
+
+    python benchmarks/import_budget.py -n 20 --budget 80
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+import subprocess
+
+from keystroke import ROOT, WARM_QUERY, Benchmark, percentile
+
+BUDGET = 80  # in ms, median import time of `base_translate`
+# Must not be imported when the query is cached.
+FORBIDDEN = (
+    'workflow.web',
+    'urllib2',
+    'httplib',
+    'mimetypes',
+    'mimetools',
+    'plistlib',
+    'shutil',
+    'xml.dom',
+)
+
+
+# Runs in a fresh interpreter, so the report only lists what the
+# workflow itself imports.
+PROBE = """
+import os, sys, time, json
+start = time.time()
+import base_translate
+import_time = time.time() - start
+from workflow import Workflow3
+stdout = sys.stdout
+sys.stdout = open(os.devnull, 'w')
+try:
+    wf = Workflow3()
+    base_translate.log = wf.logger
+    status = wf.run(base_translate.main)
+finally:
+    sys.stdout = stdout
+json.dump({'status': status, 'import': import_time,
+           'modules': sorted(name for name, module in sys.modules.items()
+                             if module is not None)}, sys.stdout)
+"""
+
+
+def measure(runs, api):
+    """Probe the cache-hit path ``runs`` times.
+
+        Returns:
+            A list of import times (in sec.) and the set of modules
+            imported by any of the runs.
+    """
+    bench = Benchmark(api)
+    times = []
+    modules = set()
+    try:
+        bench.setup()
+        for _ in range(runs):
+            output = subprocess.check_output(
+                [sys.executable, '-c', PROBE, WARM_QUERY.encode('utf-8')],
+                cwd=ROOT, env=bench.env)
+            result = json.loads(output)
+            if result['status']:
+                raise RuntimeError('Probe failed with status {0}'.format(
+                    result['status']))
+            times.append(result['import'])
+            modules.update(result['modules'])
+    finally:
+        bench.teardown()
+    return times, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='runs (default: 10)')
+    parser.add_argument('--api', choices=('GOOGL', 'MSFT'), default='GOOGL')
+    parser.add_argument('--budget', type=float, default=BUDGET,
+                        help='median import time budget in ms '
+                             '(default: {0})'.format(BUDGET))
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list all imported modules')
+    args = parser.parse_args()
+
+    times, modules = measure(args.runs, args.api)
+    median = percentile(times, 50) * 1000
+    forbidden = sorted(name for name in modules
+                       if name in FORBIDDEN or
+                       any(name.startswith(f + '.') for f in FORBIDDEN))
+
+    if args.verbose:
+        print('\n'.join(sorted(modules)))
+    print('import base_translate: p50 {0:.1f} ms, p90 {1:.1f} ms '
+          '(budget {2:.0f} ms)'.format(median,
+                                      percentile(times, 90) * 1000,
+                                      args.budget))
+    print('{0} modules imported on the cache-hit path'.format(len(modules)))
+
+    failed = False
+    if median > args.budget:
+        print('OVER BUDGET by {0:.1f} ms'.format(median - args.budget),
+              file=sys.stderr)
+        failed = True
+    for name in forbidden:
+        print('FORBIDDEN module imported: ' + name, file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keystroke latency benchmark.
+
+Times ``base_translate.py`` runs against ``tools/stub_server.py``, in
+isolated cache and data directories:
+
+    cold        empty cache directory, query goes to the network
+    warm        query is cached
+    miss        cache exists, but not the query
+    entry-warm  ``python tr.py QUERY``, the real entry point
+    entry-miss  (forwards to the daemon once it's running)
+
+Progressive results are turned off, so every run waits for the
+translation and the stages add up.
+
+For the first three, each run is a fresh Python process that drives
+``base_translate.main()`` and reports the time spent in each stage:
+import, Workflow construction, settings load, keychain, cache lookup,
+HTTP and send_feedback. Wall-clock and CPU percentiles are written as
+JSON. Compared against a baseline (``--baseline``), stages whose median
+got slower than ``--threshold`` are reported as regressions, and the
+exit status is 1.
+
+The benchmark stores a dummy API key (in the Keychain on macOS) under
+its own bundle ID and deletes it when done.
+
+    python benchmarks/keystroke.py -n 20 -o results.json
+    python benchmarks/keystroke.py --baseline results.json
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+BUNDLE_ID = 'com.sozora.google-translate.benchmark'
+SCENARIOS = ('cold', 'warm', 'miss', 'entry-warm', 'entry-miss')
+STAGES = ('import', 'workflow', 'settings', 'keychain', 'cache', 'http',
+          'feedback', 'total')
+PERCENTILES = (50, 90, 99)
+WARM_QUERY = u'benchmark warm query'
+MIN_REGRESSION = 0.001  # in sec., ignore smaller differences as noise
+
+
+def percentile(values, pct):
+    """``pct``-th percentile (nearest rank) of ``values``."""
+    values = sorted(values)
+    rank = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def summarize(samples):
+    """Percentiles and mean of a list of durations."""
+    summary = {'p{0}'.format(pct): percentile(samples, pct)
+               for pct in PERCENTILES}
+    summary['mean'] = sum(samples) / len(samples)
+    return summary
+
+
+# ---------------------------------------------------------------------
+# Worker: one `base_translate.main()` run, in its own process
+# ---------------------------------------------------------------------
+
+class StageTimer(object):
+    """Accumulates wall-clock and CPU time per stage."""
+
+    def __init__(self):
+        self.wall = dict.fromkeys(STAGES, 0.0)
+        self.cpu = dict.fromkeys(STAGES, 0.0)
+        self._active = set()
+
+    def wrap(self, stage, func):
+        """``func``, timed as ``stage``. Nested calls count once."""
+        def timed(*args, **kwargs):
+            if stage in self._active:
+                return func(*args, **kwargs)
+            self._active.add(stage)
+            wall, cpu = time.time(), time.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.wall[stage] += time.time() - wall
+                self.cpu[stage] += time.clock() - cpu
+                self._active.discard(stage)
+        return timed
+
+
+def worker(query):
+    timer = StageTimer()
+    start_wall, start_cpu = time.time(), time.clock()
+
+    import_wall, import_cpu = time.time(), time.clock()
+    import base_translate
+    import credentials
+    import google_translate
+    import msft_translate
+    import translation_cache
+    from workflow import Workflow, Workflow3
+    timer.wall['import'] = time.time() - import_wall
+    timer.cpu['import'] = time.clock() - import_cpu
+
+    Workflow.__init__ = timer.wrap('workflow', Workflow.__init__)
+    Workflow.settings = property(timer.wrap('settings',
+                                            Workflow.settings.fget))
+    credentials.CachedProvider.get = timer.wrap(
+        'keychain', credentials.CachedProvider.get)
+    translation_cache.TranslationCache.get = timer.wrap(
+        'cache', translation_cache.TranslationCache.get)
+    # `workflow.web` is only imported on a cache miss.
+    def timed_session(session):
+        def wrapper():
+            s = session()
+            if 'request' not in vars(s):
+                s.request = timer.wrap('http', s.request)
+            return s
+        return wrapper
+    for module in (google_translate, msft_translate):
+        module.session = timed_session(module.session)
+    Workflow3.send_feedback = timer.wrap('feedback', Workflow3.send_feedback)
+
+    # As in `base_translate.run`, minus the daemon.
+    sys.argv[1:] = [query.encode('utf-8')]
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        wf = Workflow3()
+        base_translate.log = wf.logger
+        status = wf.run(base_translate.main)
+    finally:
+        sys.stdout = stdout
+
+    timer.wall['total'] = time.time() - start_wall
+    timer.cpu['total'] = time.clock() - start_cpu
+    json.dump({'status': status, 'wall': timer.wall, 'cpu': timer.cpu},
+              sys.stdout)
+
+
+# ---------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class Benchmark(object):
+    """Isolated workflow environment with a stub server."""
+
+    def __init__(self, api, latency=None):
+        import stub_server
+
+        self.api = api
+        self.tempdir = tempfile.mkdtemp(prefix='tr-benchmark-')
+        port = free_port()
+        self.server = stub_server.StubServer(
+            ('127.0.0.1', port), latency=latency, quiet=True)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        base = 'http://127.0.0.1:{0}'.format(port)
+        self.env = dict(os.environ)
+        self.env.update({
+            'alfred_workflow_bundleid': BUNDLE_ID,
+            'alfred_workflow_cache': os.path.join(self.tempdir, 'cache'),
+            'alfred_workflow_data': os.path.join(self.tempdir, 'data'),
+            'alfred_version': os.getenv('alfred_version', '3.8'),
+            'google_api_url': base + stub_server.GOOGLE_PATH,
+            'msft_api_url': base + stub_server.MSFT_PATH,
+            'msft_token_url': base + stub_server.TOKEN_PATH,
+            'TMPDIR': self.tempdir,  # daemon socket
+        })
+        self._runs = 0
+
+    def setup(self):
+        """Select the API and target language, turn progressive results
+        off, and store a dummy key."""
+        code = (
+            'import base_translate as b\n'
+            'from workflow import Workflow\n'
+            'wf = Workflow()\n'
+            'wf.settings["api"] = b.{0}_API\n'
+            'wf.settings["progressive_results"] = False\n'
+            'api = b.{1}(wf)\n'
+            'api.target_lang = "de"\n'
+            'api.api_key = "benchmark"\n'
+        ).format(self.api, {'GOOGL': 'GoogleTranslate',
+                            'MSFT': 'MicrosoftTranslate'}[self.api])
+        subprocess.check_call([sys.executable, '-c', code], cwd=ROOT,
+                              env=self.env)
+        self.run_worker(WARM_QUERY)  # cache the warm query
+
+    def teardown(self):
+        code = (
+            'from workflow import Workflow\n'
+            'import base_translate as b\n'
+            'import credentials\n'
+            'wf = Workflow()\n'
+            'b.daemon_client.reset()\n'
+            'for account in ("google_translate_api_key",'
+            ' "msft_translate_api_key"):\n'
+            '    try:\n'
+            '        credentials.delete(wf, account)\n'
+            '    except Exception:\n'
+            '        pass\n'
+        )
+        subprocess.call([sys.executable, '-c', code], cwd=ROOT, env=self.env)
+        try:
+            self.stop_daemon()
+        finally:
+            self.server.shutdown()
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def stop_daemon(self, timeout=5):
+        """Ask the daemon to exit, and wait until it and `background.py`,
+        which started it and removes the PID file, are gone."""
+        code = 'import daemon_client\ndaemon_client.stop()\n'
+        subprocess.call([sys.executable, '-c', code], cwd=ROOT, env=self.env)
+        self.wait_for_daemon(running=False, timeout=timeout)
+        pidfile = os.path.join(self.env['alfred_workflow_cache'],
+                               'translate_daemon.pid')
+        deadline = time.time() + timeout
+        while os.path.exists(pidfile) and time.time() < deadline:
+            time.sleep(0.1)
+
+    def wait_for_daemon(self, running=True, timeout=5):
+        """Wait until the daemon is (or, if not ``running``, isn't)
+        listening."""
+        code = 'import sys, daemon_client\nsys.exit(daemon_client.ping())\n'
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if subprocess.call([sys.executable, '-c', code], cwd=ROOT,
+                               env=self.env) == int(running):
+                return
+            time.sleep(0.1)
+        raise RuntimeError('Daemon still {0}running after {1}s'.format(
+            'not ' if running else '', timeout))
+
+    def clear_cache(self):
+        cachedir = self.env['alfred_workflow_cache']
+        for name in os.listdir(cachedir):
+            if name.endswith('.log'):
+                continue
+            path = os.path.join(cachedir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+
+    def unique_query(self):
+        self._runs += 1
+        return u'benchmark query {0} {1}'.format(self._runs, time.time())
+
+    def _timed_call(self, args):
+        """Run ``args``; returns stdout and wall-clock and CPU time."""
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall = time.time()
+        proc = subprocess.Popen(args, cwd=ROOT, env=self.env,
+                                stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        wall = time.time() - wall
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = (after.ru_utime - before.ru_utime +
+               after.ru_stime - before.ru_stime)
+        if proc.returncode:
+            raise RuntimeError('{0!r} failed with status {1}'.format(
+                args, proc.returncode))
+        return output, wall, cpu
+
+    def run_worker(self, query):
+        output, wall, cpu = self._timed_call(
+            [sys.executable, os.path.abspath(__file__), '--worker',
+             query.encode('utf-8')])
+        result = json.loads(output)
+        # Include interpreter start-up and exit in the total.
+        result['wall']['total'] = wall
+        result['cpu']['total'] = cpu
+        return result
+
+    def run_entry_point(self, query):
+        _, wall, cpu = self._timed_call(
+            [sys.executable, os.path.join(ROOT, 'tr.py'),
+             query.encode('utf-8')])
+        return {'wall': {'total': wall}, 'cpu': {'total': cpu}}
+
+    def run(self, scenario):
+        if scenario == 'cold':
+            self.clear_cache()
+            return self.run_worker(self.unique_query())
+        elif scenario == 'warm':
+            return self.run_worker(WARM_QUERY)
+        elif scenario == 'miss':
+            return self.run_worker(self.unique_query())
+        elif scenario == 'entry-warm':
+            return self.run_entry_point(WARM_QUERY)
+        elif scenario == 'entry-miss':
+            return self.run_entry_point(self.unique_query())
+        raise ValueError('Unknown scenario: ' + scenario)
+
+
+def benchmark(scenarios, runs, api, latency=None):
+    """Run each of ``scenarios`` ``runs`` times.
+
+        Returns:
+            Dictionary of results per scenario, each with percentiles
+            of wall-clock (``wall``) and CPU (``cpu``) time per stage.
+    """
+    bench = Benchmark(api, latency)
+    results = {}
+    try:
+        bench.setup()
+        for scenario in scenarios:
+            samples = {'wall': {}, 'cpu': {}}
+            for _ in range(runs):
+                result = bench.run(scenario)
+                for kind in samples:
+                    for stage, value in result[kind].items():
+                        samples[kind].setdefault(stage, []).append(value)
+            results[scenario] = {
+                kind: {stage: summarize(values)
+                       for stage, values in samples[kind].items()}
+                for kind in samples}
+            print('{0:<12} total p50 {1:7.1f} ms'.format(
+                scenario, results[scenario]['wall']['total']['p50'] * 1000),
+                file=sys.stderr)
+    finally:
+        bench.teardown()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Stages whose median wall-clock time is more than ``threshold``
+    (fraction) slower than in ``baseline``.
+
+        Returns:
+            A list of ``(scenario, stage, baseline, result)`` tuples.
+    """
+    regressions = []
+    for scenario, result in sorted(results.items()):
+        if scenario not in baseline['results']:
+            continue
+        for stage, summary in sorted(result['wall'].items()):
+            before = baseline['results'][scenario]['wall'].get(stage)
+            if not before:
+                continue
+            now, then = summary['p50'], before['p50']
+            if now > then * (1 + threshold) and now - then > MIN_REGRESSION:
+                regressions.append((scenario, stage, then, now))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker', metavar='QUERY', help=argparse.SUPPRESS)
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='runs per scenario (default: 10)')
+    parser.add_argument('-s', '--scenario', action='append',
+                        choices=SCENARIOS, dest='scenarios',
+                        help='scenario to run (default: all)')
+    parser.add_argument('--api', choices=('GOOGL', 'MSFT'), default='GOOGL')
+    parser.add_argument('--latency', default='fixed:0',
+                        help='stub server latency, see tools/stub_server.py')
+    parser.add_argument('-o', '--output', help='write results to this file')
+    parser.add_argument('--baseline',
+                        help='compare against results from this file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown that counts as a regression '
+                             '(default: 0.2)')
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        return worker(args.worker.decode('utf-8'))
+
+    import stub_server
+    results = benchmark(args.scenarios or SCENARIOS, args.runs, args.api,
+                        stub_server.parse_latency(args.latency))
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'api': args.api,
+        'latency': args.latency,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file_obj:
+            json.dump(report, file_obj, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as file_obj:
+            baseline = json.load(file_obj)
+        regressions = compare(results, baseline, args.threshold)
+        for scenario, stage, then, now in regressions:
+            print('REGRESSION {0}/{1}: {2:.1f} ms -> {3:.1f} ms'.format(
+                scenario, stage, then * 1000, now * 1000), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Serializer benchmark.
+
+Compares load and dump time and size of the serializers registered with
+``workflow.manager`` (``marshal``, ``cpickle``, ``json``, ...) on
+translation payloads shaped like the APIs' replies:
+
+    word        one word, as returned by Google Translate
+    sentence    a sentence
+    paragraph   a paragraph of non-ASCII text
+    batch       50 lines translated in one request (``translate_many``)
+    msft        a Microsoft Translator reply for a sentence
+
+Times are the median per operation, over ``-n`` repetitions, in memory
+(the file system isn't involved).
+
+    python benchmarks/serializers.py -n 2000
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+import argparse
+from cStringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from workflow import manager  # noqa: E402
+from stub_server import fake_translation  # noqa: E402
+
+SERIALIZERS = ('marshal', 'cpickle', 'json')
+SENTENCE = u'The quick brown fox jumps over the lazy dog near the river bank.'
+PARAGRAPH = (u'Über den Wolken muss die Freiheit wohl grenzenlos sein. '
+             u'Alle Ängste, alle Sorgen, sagt man, blieben darunter '
+             u'verborgen, und dann würde, was uns groß und wichtig '
+             u'erscheint, plötzlich nichtig und klein. ') * 4
+
+
+def google(texts, target='de'):
+    """Google Translate v2 translations of ``texts``."""
+    return [{u'translatedText': fake_translation(text, target),
+             u'detectedSourceLanguage': u'en'}
+            for text in texts]
+
+
+def payloads():
+    """Payloads by name, in the order they're reported."""
+    return [
+        ('word', google([u'house'])),
+        ('sentence', google([SENTENCE])),
+        ('paragraph', google([PARAGRAPH])),
+        ('batch', google([u'{0} {1}'.format(SENTENCE, i)
+                          for i in range(50)])),
+        ('msft', [{u'detectedLanguage': {u'language': u'en',
+                                         u'score': 1.0},
+                   u'translations': [{u'text': fake_translation(SENTENCE,
+                                                                u'fr'),
+                                      u'to': u'fr'}]}]),
+    ]
+
+
+def median_time(func, runs):
+    """Median duration of ``func()`` in seconds, over batches of calls."""
+    timer = timeit.Timer(func)
+    number = max(runs // 20, 1)
+    return sorted(timer.repeat(repeat=20, number=number))[10] / number
+
+
+def measure(name, payload, runs):
+    """Size and dump and load times of ``payload`` with serializer
+    ``name``."""
+    serializer = manager.serializer(name)
+
+    def dump():
+        serializer.dump(payload, StringIO())
+
+    data_obj = StringIO()
+    serializer.dump(payload, data_obj)
+    data = data_obj.getvalue()
+
+    def load():
+        return serializer.load(StringIO(data))
+
+    assert load() == payload, name
+    return {'size': len(data), 'dump': median_time(dump, runs),
+            'load': median_time(load, runs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--runs', type=int, default=2000,
+                        help='repetitions per measurement (default: 2000)')
+    parser.add_argument('-s', '--serializer', action='append',
+                        choices=manager.serializers,
+                        help='serializer to compare (repeatable, '
+                             'default: {0})'.format(', '.join(SERIALIZERS)))
+    args = parser.parse_args()
+
+    print('{0:<10} {1:<8} {2:>8} {3:>10} {4:>10}'.format(
+        'payload', 'format', 'bytes', 'dump us', 'load us'))
+    for payload_name, payload in payloads():
+        for name in args.serializer or SERIALIZERS:
+            result = measure(name, payload, args.runs)
+            print('{0:<10} {1:<8} {2:>8} {3:>10.1f} {4:>10.1f}'.format(
+                payload_name, name, result['size'], result['dump'] * 1e6,
+                result['load'] * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
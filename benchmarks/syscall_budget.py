@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""System call budget for the cache-hit path.
+
+Traces ``tr.py``, the script filter's entry point, for a cached query
+(set up as by ``keystroke.py``) with ``strace`` (Linux) or ``dtruss``
+(macOS, needs root) and counts the system calls it makes, from running
+``tr.py`` to its exit. Interpreter start-up is left out; the imports of
+``tr.py`` are counted. Child processes (the daemon being started) aren't
+traced. Two paths:
+
+    forward     the daemon is running: ``tr.py`` forwards the query
+    in-process  it isn't: ``tr.py`` imports ``base_translate`` and
+                answers the query itself, then starts the daemon
+
+Only the traced process's own system calls are counted, as with
+``strace -q`` without ``-f``: each line of the trace that starts a call
+counts once. Exits with status 1 if the count exceeds ``--budget``, and
+2 if no tracer is available.
+
+The default budgets are counts recorded on Linux x86_64 (Debian 12,
+Python 2.7.18, glibc 2.36) plus ``MARGIN``. As strace wasn't installed
+there, they were taken with a ptrace-based counter that stops at every
+system call entry of the traced process and prints strace's line format
+(``name("path", ...) = 0``), so the markers and ``SYSCALL`` match as they
+do with strace. Counts depend on the Python installation (e.g. the
+length of ``sys.path``): on other systems, record your own budget with
+``--record``, which prints the count plus ``MARGIN``, and pass it as
+``--budget``.
+
+    python benchmarks/syscall_budget.py --path in-process --record -v
+    python benchmarks/syscall_budget.py --path in-process --budget 2438
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import math
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+from keystroke import ROOT, WARM_QUERY, Benchmark
+
+# System calls made by `tr.py` on a cache hit, as printed by `--record`
+# on Linux: counts (forward: 1,024, in-process: 2,216) plus `MARGIN`.
+# Most are imports looking for modules along `sys.path`.
+BUDGETS = {'forward': 1127, 'in-process': 2438}
+MARGIN = 0.1
+# Looked up (and not found) to mark the start and end of the run.
+BEGIN_MARKER = '/.tr-syscall-budget-begin'
+END_MARKER = '/.tr-syscall-budget-end'
+# `NAME(` at the start of a line, after the PID (`strace -f`) or
+# `PID/TID:` (dtruss). Resumed calls, signals and exits don't match.
+SYSCALL = re.compile(r'^(?:\[pid\s+\d+\]\s*|\d+(?:/0x[0-9a-f]+:)?\s+)?'
+                     r'(\w+)\(')
+
+# Runs `tr.py` as Alfred does, with the query as its argument.
+PROBE = """
+import os, sys, runpy
+# stderr is the trace
+sys.stdout = sys.stderr = open(os.devnull, 'w')
+os.path.exists({begin!r})
+try:
+    runpy.run_path('tr.py', run_name='__main__')
+finally:
+    os.path.exists({end!r})
+""".format(begin=BEGIN_MARKER, end=END_MARKER)
+
+
+def tracer():
+    """Command prefix that traces a program, or ``None`` if neither
+    tracer is installed. Both write the trace to stderr."""
+    for name, command in (('strace', ['strace', '-q']),
+                          ('dtruss', ['dtruss'])):
+        for path in os.environ.get('PATH', '').split(os.pathsep):
+            if os.access(os.path.join(path, name), os.X_OK):
+                return command
+    return None
+
+
+def count_syscalls(lines):
+    """Count the system calls between the begin and end markers.
+
+        Arguments:
+            lines: trace output
+
+        Returns:
+            A ``Counter`` of system call names.
+    """
+    counts = Counter()
+    tracing = False
+    for line in lines:
+        if BEGIN_MARKER in line:
+            tracing = True
+            continue
+        if END_MARKER in line:
+            break
+        match = SYSCALL.match(line)
+        if tracing and match:
+            counts[match.group(1)] += 1
+    if not tracing:
+        raise RuntimeError('Begin marker not found in trace')
+    return counts
+
+
+def measure(api, path):
+    """Trace the cache-hit ``path`` (``forward`` or ``in-process``) once.
+
+        Returns:
+            A ``Counter`` of system call names, or ``None`` if no
+            tracer is available.
+    """
+    command = tracer()
+    if not command:
+        return None
+    bench = Benchmark(api)
+    try:
+        bench.setup()
+        # Warm up the OS caches, and start the daemon.
+        bench.run_entry_point(WARM_QUERY)
+        bench.wait_for_daemon()
+        if path == 'in-process':
+            bench.stop_daemon()
+        with tempfile.TemporaryFile(prefix='tr-syscalls-') as trace:
+            subprocess.check_call(
+                command + [sys.executable, '-c', PROBE,
+                           WARM_QUERY.encode('utf-8')],
+                cwd=ROOT, env=bench.env, stderr=trace)
+            trace.seek(0)
+            return count_syscalls(trace)
+    finally:
+        bench.teardown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api', choices=('GOOGL', 'MSFT'), default='GOOGL')
+    parser.add_argument('--path', choices=sorted(BUDGETS), default='forward',
+                        help='cache-hit path to trace (default: forward)')
+    parser.add_argument('--budget', type=int,
+                        help='system call budget (default: {0})'.format(
+                            ', '.join('{0} for {1}'.format(budget, path)
+                                      for path, budget in
+                                      sorted(BUDGETS.items()))))
+    parser.add_argument('--record', action='store_true',
+                        help='print the budget for this system (count '
+                             'plus {0:.0f} %%) instead of checking '
+                             'it'.format(MARGIN * 100))
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='count per system call')
+    args = parser.parse_args()
+    budget = args.budget or BUDGETS[args.path]
+
+    counts = measure(args.api, args.path)
+    if counts is None:
+        print('Neither strace nor dtruss found', file=sys.stderr)
+        return 2
+
+    total = sum(counts.values())
+    if args.verbose:
+        for name, count in counts.most_common():
+            print('{0:>6}  {1}'.format(count, name))
+    if args.record:
+        print('{0} system calls on the {1} cache-hit path: pass --budget '
+              '{2}'.format(total, args.path,
+                           int(math.ceil(total * (1 + MARGIN)))))
+        return 0
+    print('{0} system calls on the {1} cache-hit path (budget {2})'.format(
+        total, args.path, budget))
+    if total > budget:
+        print('OVER BUDGET by {0}'.format(total - budget),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
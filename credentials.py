@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Where API keys come from.
+
+Reading a key from the Keychain spawns the ``security`` program, which
+is too slow to do several times per keystroke. Keys are looked up
+through a provider, one of:
+
+    KeychainProvider  the macOS Keychain (``Workflow.get_password``)
+    FileProvider      a JSON file in the data directory, readable only by
+                      the user (Linux, tests)
+    DaemonProvider    the resident daemon, which holds keys in memory, or
+                      another provider if the daemon isn't running
+
+wrapped in a :class:`CachedProvider` that remembers keys for
+``credentials_ttl`` seconds (setting). The backend is chosen with the
+``credentials_backend`` setting: ``keychain`` (default on macOS) or
+``file`` (default elsewhere).
+
+Missing keys raise ``PasswordNotFound``, as with the Keychain.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+
+import daemon_client
+from workflow import PasswordNotFound
+
+CACHE_TTL = 60*10  # in sec.
+FILENAME = 'credentials.json'
+PROPS = {
+    'BACKEND': 'credentials_backend',
+    'TTL': 'credentials_ttl',
+}
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+class KeychainProvider(object):
+    """Keys in the macOS Keychain, under the workflow's bundle ID."""
+
+    def __init__(self, wf):
+        self.wf = wf
+
+    def get(self, account):
+        return self.wf.get_password(account)
+
+    def set(self, account, secret):
+        self.wf.save_password(account, secret)
+
+    def delete(self, account):
+        self.wf.delete_password(account)
+
+
+class FileProvider(object):
+    """Keys in a JSON file only the user may read."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as file_obj:
+                return json.load(file_obj)
+        except IOError:
+            return {}
+
+    def _save(self, secrets):
+        temp = self.path + '.tmp'
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as file_obj:
+            json.dump(secrets, file_obj)
+        os.rename(temp, self.path)
+
+    def get(self, account):
+        secrets = self._load()
+        if account not in secrets:
+            raise PasswordNotFound(account)
+        return secrets[account]
+
+    def set(self, account, secret):
+        secrets = self._load()
+        secrets[account] = secret
+        self._save(secrets)
+
+    def delete(self, account):
+        secrets = self._load()
+        if secrets.pop(account, None) is None:
+            raise PasswordNotFound(account)
+        self._save(secrets)
+
+
+class DaemonProvider(object):
+    """Keys from the memory of the resident daemon, without spawning
+    anything. Falls back to ``backend`` if the daemon isn't running.
+    Keys are only ever written to ``backend``.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, account):
+        secret = daemon_client.credential(account)
+        if secret is daemon_client.UNREACHABLE:
+            return self.backend.get(account)
+        if secret is None:
+            raise PasswordNotFound(account)
+        return secret
+
+    def set(self, account, secret):
+        self.backend.set(account, secret)
+
+    def delete(self, account):
+        self.backend.delete(account)
+
+
+class CachedProvider(object):
+    """Remembers keys of ``provider`` for ``ttl`` seconds. Thread-safe."""
+
+    def __init__(self, provider, ttl=CACHE_TTL):
+        self.provider = provider
+        self.ttl = ttl
+        self._secrets = {}
+        self._lock = threading.Lock()
+
+    def get(self, account):
+        with self._lock:
+            secret, expires = self._secrets.get(account, (None, 0))
+            if time.time() < expires:
+                return secret
+            secret = self.provider.get(account)
+            self._secrets[account] = (secret, time.time() + self.ttl)
+            return secret
+
+    def set(self, account, secret):
+        with self._lock:
+            self._secrets.pop(account, None)
+            self.provider.set(account, secret)
+
+    def delete(self, account):
+        with self._lock:
+            self._secrets.pop(account, None)
+            self.provider.delete(account)
+
+    def forget(self):
+        """Drop all remembered keys."""
+        with self._lock:
+            self._secrets.clear()
+
+
+def backend(wf):
+    """Provider storing the keys, as set in ``credentials_backend``."""
+    default = 'keychain' if sys.platform == 'darwin' else 'file'
+    name = wf.settings.get(PROPS['BACKEND'], default)
+    if name == 'file':
+        return FileProvider(wf.datafile(FILENAME))
+    if name == 'keychain':
+        return KeychainProvider(wf)
+    raise ValueError('Unknown credentials backend: {0}'.format(name))
+
+
+def provider(wf):
+    """The :class:`CachedProvider` of this process.
+
+    Unless set with :func:`use`, it asks the daemon before the backend.
+
+        Arguments:
+            wf: Workflow instance
+
+        Returns:
+            A :class:`CachedProvider`.
+    """
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = CachedProvider(
+                DaemonProvider(backend(wf)),
+                wf.settings.get(PROPS['TTL'], CACHE_TTL))
+        return _provider
+
+
+def use(cached_provider):
+    """Make ``cached_provider`` the provider of this process."""
+    global _provider
+    with _provider_lock:
+        _provider = cached_provider
+
+
+def get(wf, account):
+    """Key stored for ``account``. Raises ``PasswordNotFound``."""
+    return provider(wf).get(account)
+
+
+def set(wf, account, secret):
+    """Store ``secret`` as the key for ``account``."""
+    provider(wf).set(account, secret)
+
+
+def delete(wf, account):
+    """Delete the key stored for ``account``."""
+    provider(wf).delete(account)
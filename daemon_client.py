@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Client for the resident translation daemon (``translate_daemon.py``).
+
+Only uses the standard library, so forwarding a query doesn't pay for
+importing and setting up the workflow library.
+"""
+
+import os
+import sys
+import json
+import socket
+
+SOCKET_NAME = '{bundleid}.{uid}.sock'
+DEFAULT_BUNDLE_ID = 'com.sozora.google-translate'
+DAEMON_NAME = 'translate_daemon'
+REPLY_TIMEOUT = 30  # in sec.
+# Returned by `credential` if the daemon isn't running.
+UNREACHABLE = object()
+
+
+def socket_path():
+    """Path to the daemon's Unix socket.
+
+    The socket lives in the temporary directory rather than the
+    workflow's cache directory, as the latter easily exceeds the
+    104-byte limit for socket paths on OS X.
+
+        Returns:
+            Path to socket.
+    """
+    name = SOCKET_NAME.format(
+        bundleid=os.getenv('alfred_workflow_bundleid', DEFAULT_BUNDLE_ID),
+        uid=os.getuid())
+    return os.path.join(os.getenv('TMPDIR', '/tmp'), name)
+
+
+def is_query(args):
+    """Whether command line ``args`` are a plain query the daemon serves.
+
+    Options (``--setkey`` etc.) and magic arguments change state or exit
+    the process, so they are always run in-process.
+    """
+    return (len(args) == 1 and not args[0].startswith('-')
+            and 'workflow:' not in args[0])
+
+
+def _call(request):
+    """Send ``request`` to the daemon and return its decoded reply.
+
+        Returns:
+            Reply dictionary or None if the daemon isn't reachable.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(REPLY_TIMEOUT)
+    try:
+        sock.connect(socket_path())
+        sock.sendall(json.dumps(request) + '\n')
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except socket.error:
+        return None
+    finally:
+        sock.close()
+
+    try:
+        return json.loads(''.join(chunks))
+    except ValueError:
+        return None
+
+
+def forward(args, generation=None):
+    """Have the daemon run ``args`` and write its output to stdout.
+
+        Arguments:
+            args: command line arguments, as in ``sys.argv[1:]``
+            generation: generation of the query, see :mod:`supersede`
+
+        Returns:
+            Exit status of the run or None if the daemon isn't running,
+            in which case nothing has been written.
+    """
+    reply = _call({'command': 'run', 'args': args,
+                   'generation': generation})
+    if reply is None:
+        return None
+
+    sys.stdout.write(reply['output'].encode('utf-8'))
+    sys.stdout.flush()
+    return reply['status']
+
+
+def ping():
+    """Whether a daemon is listening on :func:`socket_path`."""
+    return _call({'command': 'ping'}) is not None
+
+
+def credential(account):
+    """API key stored for ``account``, as known to the daemon.
+
+        Returns:
+            The key, None if there is none or ``UNREACHABLE`` if the
+            daemon isn't running.
+    """
+    reply = _call({'command': 'credential', 'account': account})
+    if reply is None:
+        return UNREACHABLE
+    return reply.get('secret')
+
+
+def reset():
+    """Tell a running daemon to drop cached settings and credentials."""
+    _call({'command': 'reset'})
+
+
+def stop():
+    """Tell a running daemon to exit."""
+    _call({'command': 'stop'})
+
+
+def start(wf):
+    """Start the daemon in the background unless it is already running."""
+    from workflow.background import run_in_background, is_running
+
+    if is_running(DAEMON_NAME):
+        return
+    cmd = ['/usr/bin/env', 'python', wf.workflowfile('translate_daemon.py')]
+    run_in_background(DAEMON_NAME, cmd)
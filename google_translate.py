@@ -2,27 +2,53 @@
 # -*- coding: utf-8 -*-
 
 import os
-from urllib2 import quote, HTTPError
-from hashlib import sha224
 
-from workflow import web, PasswordNotFound, KeychainError
+import credentials
+import supersede
+import translation_cache
 
 MAX_AGE_CACHE = 60*60*24  # in sec.
-API_URL = 'https://translation.googleapis.com/language/translate/v2'
+MAX_STALE_AGE = 60*60*24*30  # in sec., stale-while-revalidate
+MAX_BATCH = 128  # max. number of `q` values per request
+MAX_GET_URL = 2000  # longer requests are sent as POST
+# Socket timeout of requests: a stalled request fails instead of keeping
+# a keystroke (or a connection of the daemon's pool) waiting.
+REQUEST_TIMEOUT = 5  # in sec.
+# Overridable (workflow variable) to test against tools/stub_server.py.
+API_URL = os.getenv('google_api_url',
+                    'https://translation.googleapis.com/language/translate/v2')
 QUICK_LOOK_URL = 'https://translate.google.com/'
 ICON_PATH = 'icons'
 PROPS = {
     'API_KEY': 'google_translate_api_key',
     'TARGET_LANG': 'google_target_lang',
+    'TARGET_LANGS': 'google_target_langs',
 }
 DEFAULT_ICON = 'google-tr-icon.png'
 
+# Keep-alive connections, reused across requests (and keystrokes, when
+# running in the daemon). Created on first use: a cache hit doesn't need
+# `workflow.web` (urllib2, httplib, ...).
+_session = None
+
+
+def session():
+    """Shared :class:`workflow.web.Session` for Google's APIs."""
+    global _session
+    if _session is None:
+        from workflow import web
+        _session = web.Session()
+    return _session
+
 
 class GoogleTranslate(object):
-    def __init__(self, wf, query=None, source_lang='#auto'):
+    def __init__(self, wf, query=None, source_lang='#auto', target_lang=None,
+                 generation=None):
         self.wf = wf
         self._query = query
         self._source_lang = source_lang
+        self._target_lang = target_lang
+        self._generation = generation
 
     def __get_translations(self):
         """ Get translation from Google Translate API.
@@ -38,8 +64,29 @@ class GoogleTranslate(object):
                 &q=<QUERY> (required)
         """
 
-        params = dict(key=self.api_key, target=self.target_lang, q=self.query)
-        r = web.get(API_URL, params)
+        return self.__fetch([self.query])
+
+    def __fetch(self, texts):
+        """Translate ``texts`` in one request.
+
+            Arguments:
+                texts: list of texts to translate
+
+            Returns:
+                A list of translation dictionaries, one per text.
+        """
+        from urllib import urlencode
+        from urllib2 import HTTPError
+        supersede.check(self.generation)
+        params = [('key', self.api_key), ('target', self.target_lang)]
+        params.extend(('q', text) for text in texts)
+        data = urlencode([(k, v.encode('utf-8')) for k, v in params])
+        if len(API_URL) + len(data) + 1 > MAX_GET_URL:
+            r = session().post(API_URL, data=data,
+                               timeout=REQUEST_TIMEOUT)
+        else:
+            r = session().get(API_URL + '?' + data,
+                              timeout=REQUEST_TIMEOUT)
         try:
             r.raise_for_status()
         except HTTPError as e:
@@ -54,29 +101,37 @@ class GoogleTranslate(object):
         translations = result['data']['translations']
         return translations
 
+    @staticmethod
+    def preconnect():
+        """Open a connection to Google ahead of the first request."""
+        session().preconnect(API_URL)
+
     @property
     def api_key(self):
-        try:
-            __api_key = self.wf.get_password(PROPS['API_KEY'])
-            return __api_key
-        except PasswordNotFound as e:
-            raise e
+        return credentials.get(self.wf, PROPS['API_KEY'])
 
     @api_key.setter
     def api_key(self, value):
-        try:
-            self.wf.save_password(PROPS['API_KEY'], value)
-        except KeychainError as e:
-            raise e
+        credentials.set(self.wf, PROPS['API_KEY'], value)
 
     @property
     def target_lang(self):
+        if self._target_lang:
+            return self._target_lang
         return self.wf.settings.get(PROPS['TARGET_LANG'], None)
 
     @target_lang.setter
     def target_lang(self, value):
         self.wf.settings[PROPS['TARGET_LANG']] = value
 
+    @property
+    def target_langs(self):
+        """All languages to translate to, see ``tr-setlang``."""
+        langs = self.wf.settings.get(PROPS['TARGET_LANGS'], None)
+        if langs:
+            return langs
+        return [self.target_lang] if self.target_lang else []
+
     @property
     def query(self):
         return self._query
@@ -85,6 +140,15 @@ class GoogleTranslate(object):
     def query(self, value):
         self._query = value
 
+    @property
+    def generation(self):
+        """Generation of the query, see :mod:`supersede`."""
+        return self._generation
+
+    @generation.setter
+    def generation(self, value):
+        self._generation = value
+
     @property
     def source_lang(self):
         return self._source_lang
@@ -93,29 +157,159 @@ class GoogleTranslate(object):
     def source_lang(self, value):
         self._source_lang = value
 
-    def get_translations(self):
-        cache_key = sha224(('GOOGL' + self.target_lang + self.query)
-                           .encode('utf-8')).hexdigest()
-        # Get from cache translations newer than MAX_AGE_CACHE
-        translations = self.wf.cached_data(cache_key,
-                                           self.__get_translations,
-                                           max_age=MAX_AGE_CACHE)
+    def __cache_key(self, query):
+        return translation_cache.cache_key(
+            'GOOGL', self.source_lang, self.target_lang,
+            translation_cache.normalize(self.wf, query))
+
+    def __cached(self, query):
+        """Translation of ``query`` from the translation store, if newer
+        than ``MAX_AGE_CACHE``. Translations up to ``MAX_STALE_AGE`` old
+        are returned as well, and refreshed in the background.
+        """
+        store = translation_cache.open_store(self.wf)
+        return store.get(self.__cache_key(query), max_age=MAX_AGE_CACHE,
+                         fallback=translation_cache.legacy_key(
+                             'GOOGL', self.target_lang, query),
+                         max_stale_age=MAX_STALE_AGE,
+                         refresh=translation_cache.refresh_command(
+                             self.wf, 'GOOGL', self.target_lang, query))
 
+    def __cache(self, query, translations):
+        if supersede.is_superseded(self.generation):
+            return  # Alfred has moved on to a newer query
+        store = translation_cache.open_store(self.wf)
+        store.set(self.__cache_key(query), translations, provider='GOOGL',
+                  source=self.source_lang, target=self.target_lang,
+                  query=translation_cache.normalize(self.wf, query))
+
+    def __make_items(self, query, translations):
+        from urllib import quote
         trans = []
         for tr in translations:
             trans.append({
                 'title': tr['translatedText'],
-                'subtitle': self.query + ' [google]',
+                'subtitle': query + ' [google]',
                 'valid': True,
                 'arg': tr['translatedText'],
                 'copytext': tr['translatedText'],
                 'largetext': tr['translatedText'],
                 'quicklookurl': QUICK_LOOK_URL + self.source_lang
                                 + '/' + self.target_lang + '/'
-                                + quote(self.query.encode('utf-8')),
+                                + quote(query.encode('utf-8')),
                 'icon': GoogleTranslate.get_icon(self.target_lang)})
         return trans
 
+    def cached_translations(self, texts=None):
+        """Translations of :attr:`query` from the cache, without going to
+        the network. Or, if given, of each of ``texts``, as
+        :meth:`translate_many` returns them.
+
+            Returns:
+                A list of translation dictionaries or None if the query
+                (or one of ``texts``) isn't cached.
+        """
+        trans = []
+        for text in texts or [self.query]:
+            translations = self.__cached(text)
+            if translations is None:
+                return None
+            trans.extend(self.__make_items(text, translations))
+        return trans
+
+    def fetch_translations(self):
+        """Translations of :attr:`query` from Google, cached for next
+        time. Needs the API key: only called once the cache has missed.
+
+            Returns:
+                A list of translation dictionaries.
+        """
+        translations = self.__get_translations()
+        self.__cache(self.query, translations)
+        return self.__make_items(self.query, translations)
+
+    def get_translations(self):
+        # Get from cache translations newer than MAX_AGE_CACHE
+        translations = self.cached_translations()
+        if translations is None:
+            translations = self.fetch_translations()
+        return translations
+
+    def suggestions(self):
+        """Past translations of queries similar to :attr:`query`, from
+        the translation memory. Shown when Google can't be reached.
+
+            Returns:
+                A list of translation dictionaries, most similar first,
+                with the ``similarity`` (0 to 1) of their query.
+        """
+        store = translation_cache.open_store(self.wf)
+        trans = []
+        for similarity, query, translations in store.similar(
+                'GOOGL', self.target_lang,
+                translation_cache.normalize(self.wf, self.query)):
+            for tr in self.__make_items(query, translations):
+                tr['subtitle'] = u'{0:.0%} similar: {1}'.format(
+                    similarity, tr['subtitle'])
+                tr['similarity'] = similarity
+                trans.append(tr)
+        return trans
+
+    def refresh(self):
+        """Fetch :attr:`query` again and update the cache."""
+        self.__cache(self.query, self.__get_translations())
+
+    def missing(self, texts):
+        """Those of ``texts`` that aren't cached, or are older than
+        ``MAX_AGE_CACHE``.
+        """
+        keys = [self.__cache_key(text) for text in texts]
+        store = translation_cache.open_store(self.wf)
+        missing = store.missing(keys, MAX_AGE_CACHE)
+        return [text for key, text in zip(keys, texts) if key in missing]
+
+    def prefetch(self, texts):
+        """Translate ``texts`` and cache the translations, up to
+        ``MAX_BATCH`` texts per request. For ``--warm``.
+        """
+        for i in range(0, len(texts), MAX_BATCH):
+            batch = texts[i:i + MAX_BATCH]
+            for text, tr in zip(batch, self.__fetch(batch)):
+                self.__cache(text, [tr])
+
+    def translate_many(self, texts):
+        """Translate several texts with as few requests as possible.
+
+        Each text is cached separately, under the same key
+        :meth:`get_translations` uses. Only texts missing from the cache
+        are sent to Google, up to ``MAX_BATCH`` per request.
+
+            Arguments:
+                texts: list of texts to translate
+
+            Returns:
+                A list of translation dictionaries, one per text.
+        """
+        translations = {}
+        misses = []
+        for text in texts:
+            cached = self.__cached(text)
+            if cached is not None:
+                translations[text] = cached
+            elif text not in misses:
+                misses.append(text)
+
+        for i in range(0, len(misses), MAX_BATCH):
+            batch = misses[i:i + MAX_BATCH]
+            for text, tr in zip(batch, self.__fetch(batch)):
+                translations[text] = [tr]
+                self.__cache(text, [tr])
+
+        trans = []
+        for text in texts:
+            trans.extend(self.__make_items(text, translations[text]))
+        return trans
+
     @staticmethod
     def get_icon(lang_code=None):
         """Get language icon.
@@ -2,62 +2,150 @@
 # -*- coding: utf-8 -*-
 
 import os
-from urllib2 import quote, HTTPError
-from hashlib import sha224
-from xml.etree import ElementTree
+import json
+import time
+import threading
 
-from workflow import web, PasswordNotFound
+import credentials
+import supersede
+import translation_cache
 
 MAX_AGE_CACHE = 60*60*24  # in sec.
-API_URL = 'https://api.microsofttranslator.com/v2/http.svc/Translate'
+MAX_STALE_AGE = 60*60*24*30  # in sec., stale-while-revalidate
+TOKEN_LIFETIME = 60*10  # in sec.
+TOKEN_REFRESH_AHEAD = 60*3  # in sec. before expiry, refreshed in background
+TOKEN_MIN_VALIDITY = 30  # in sec., enough for a request
+MAX_BATCH = 100  # max. number of texts per request
+MAX_BATCH_CHARS = 10000  # max. total length of texts per request
+REQUEST_TIMEOUT = 5  # in sec., socket timeout of requests
+# Overridable (workflow variables) to test against tools/stub_server.py.
+API_URL = os.getenv('msft_api_url',
+                    'https://api.cognitive.microsofttranslator.com/translate')
+TOKEN_URL = os.getenv(
+    'msft_token_url',
+    'https://api.cognitive.microsoft.com/sts/v1.0/issueToken')
+API_VERSION = '3.0'
 QUICK_LOOK_URL = 'https://www.bing.com/translator/'
 ICON_PATH = 'icons'
-TOKEN_URL = 'https://api.cognitive.microsoft.com/sts/v1.0/issueToken'
 PROPS = {
     'API_KEY': 'msft_translate_api_key',
     'TOKEN': 'msft_translate_token',
     'TARGET_LANG': 'msft_target_lang',
+    'TARGET_LANGS': 'msft_target_langs',
 }
 DEFAULT_ICON = 'msft-icon.png'
 
+# Keep-alive connections, reused across requests (and keystrokes, when
+# running in the daemon). Created on first use: a cache hit doesn't need
+# `workflow.web` (urllib2, httplib, ...).
+_session = None
+# Held while checking and refreshing the access token: the threads of
+# several target languages share one token, and only one of them gets a
+# new one.
+_token_lock = threading.Lock()
+
+
+def session():
+    """Shared :class:`workflow.web.Session` for Microsoft's APIs."""
+    global _session
+    if _session is None:
+        from workflow import web
+        _session = web.Session()
+    return _session
+
 
 class MicrosoftTranslate(object):
-    def __init__(self, wf, query=None, source_lang=None):
+    def __init__(self, wf, query=None, source_lang=None, target_lang=None,
+                 generation=None):
         self.wf = wf
         self._query = query
         self._source_lang = source_lang
+        self._target_lang = target_lang
+        self._generation = generation
 
     def __get_token(self):
         params = {'Subscription-Key': self.api_key}
-        r = web.post(TOKEN_URL, params)
+        r = session().post(TOKEN_URL, params, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
         return 'Bearer' + ' ' + r.content
 
+    def refresh_token(self):
+        """Get a new access token and cache it with its expiry time.
+
+            Returns:
+                The token.
+        """
+        expires = time.time() + TOKEN_LIFETIME
+        token = self.__get_token()
+        self.wf.cache_data(PROPS['TOKEN'], {'token': token,
+                                            'expires': expires})
+        return token
+
     @property
     def token(self):
-        return self.wf.cached_data(PROPS['TOKEN'], self.__get_token,
-                                   max_age=60*9)  # token expires in 10 min
+        """Access token for the API.
+
+        Only fetched while the user waits if there is no valid token.
+        A token that is about to expire is refreshed in the background
+        (``base_translate.py --refresh-token``).
+        """
+        with _token_lock:
+            cached = self.wf.cached_data(PROPS['TOKEN'], max_age=0)
+            if not isinstance(cached, dict):  # none, or without expiry
+                return self.refresh_token()
+            remaining = cached['expires'] - time.time()
+            if remaining < TOKEN_MIN_VALIDITY:
+                return self.refresh_token()
+            if remaining < TOKEN_REFRESH_AHEAD:
+                from workflow.background import run_in_background
+                run_in_background('msft_token_refresh', [
+                    '/usr/bin/env', 'python',
+                    self.wf.workflowfile('base_translate.py'),
+                    '--refresh-token'])
+            return cached['token']
 
     @token.setter
     def token(self, value):
         self.wf.settings[PROPS['TOKEN']] = value
 
     def __get_translations(self):
-        """ Get translation from Microsoft Cognitive Services API.
+        """ Get translation from Microsoft Translator Text API.
 
         Returns:
-             A list of translation dictionaries.
+             The translation.
 
         MSFT Translate URL and arguments:
-            https://api.microsofttranslator.com/v2/http.svc/Translate?
-                appid=Bearer + ' ' + <TOKEN>(required)
+            https://api.cognitive.microsofttranslator.com/translate?
+                api-version=3.0 (required)
                 &from=<SOURCE_LANG> (optional)
                 &to=<TARGET_LANG> (required)
-                &text=<QUERY> (required)
+            Headers:
+                Authorization: Bearer <TOKEN> (required)
+            JSON body:
+                [{"Text": <QUERY>}] (required)
         """
 
-        params = dict(appid=self.token, to=self.target_lang, text=self.query)
-        r = web.get(API_URL, params)
+        return self.__fetch([self.query])[0]
+
+    def __fetch(self, texts):
+        """Translate ``texts`` in one request.
+
+            Arguments:
+                texts: list of texts to translate
+
+            Returns:
+                A list of translations, one per text.
+        """
+        from urllib import urlencode
+        from urllib2 import HTTPError
+        supersede.check(self.generation)
+        url = API_URL + '?' + urlencode([('api-version', API_VERSION),
+                                         ('to', self.target_lang)])
+        headers = {'Authorization': self.token,
+                   'Content-Type': 'application/json; charset=UTF-8'}
+        r = session().post(url, data=json.dumps([{'Text': text}
+                                                 for text in texts]),
+                           headers=headers, timeout=REQUEST_TIMEOUT)
         try:
             r.raise_for_status()
         except HTTPError as e:
@@ -67,31 +155,42 @@ class MicrosoftTranslate(object):
             else:
                 raise e
 
-        # Parse the XML and extract the translation.
-        result = ElementTree.fromstring(r.text.encode('utf-8'))
-        return result.text
+        # One result per text, each with one translation per target
+        # language.
+        return [result['translations'][0]['text'] for result in r.json()]
+
+    @staticmethod
+    def preconnect():
+        """Open connections to Microsoft ahead of the first request."""
+        session().preconnect(API_URL)
+        session().preconnect(TOKEN_URL)
 
     @property
     def api_key(self):
-        try:
-            api_key = self.wf.get_password(PROPS['API_KEY'])
-        except PasswordNotFound as e:
-            raise e
-        else:
-            return api_key
+        return credentials.get(self.wf, PROPS['API_KEY'])
 
     @api_key.setter
     def api_key(self, value):
-        self.wf.save_password(PROPS['API_KEY'], value)
+        credentials.set(self.wf, PROPS['API_KEY'], value)
 
     @property
     def target_lang(self):
+        if self._target_lang:
+            return self._target_lang
         return self.wf.settings.get(PROPS['TARGET_LANG'], None)
 
     @target_lang.setter
     def target_lang(self, value):
         self.wf.settings[PROPS['TARGET_LANG']] = value
 
+    @property
+    def target_langs(self):
+        """All languages to translate to, see ``tr-setlang``."""
+        langs = self.wf.settings.get(PROPS['TARGET_LANGS'], None)
+        if langs:
+            return langs
+        return [self.target_lang] if self.target_lang else []
+
     @property
     def query(self):
         return self._query
@@ -100,6 +199,15 @@ class MicrosoftTranslate(object):
     def query(self, value):
         self._query = value
 
+    @property
+    def generation(self):
+        """Generation of the query, see :mod:`supersede`."""
+        return self._generation
+
+    @generation.setter
+    def generation(self, value):
+        self._generation = value
+
     @property
     def source_lang(self):
         return self._source_lang
@@ -108,24 +216,163 @@ class MicrosoftTranslate(object):
     def source_lang(self, value):
         self._source_lang = value
 
-    def get_translations(self):
-        cache_key = sha224(('MSFT' + self.target_lang + self.query)
-                           .encode('utf-8')).hexdigest()
-        # Get from cache translations newer than MAX_AGE_CACHE
-        translation = self.wf.cached_data(cache_key, self.__get_translations,
-                                          max_age=MAX_AGE_CACHE)
+    def __cache_key(self, query):
+        return translation_cache.cache_key(
+            'MSFT', self.source_lang, self.target_lang,
+            translation_cache.normalize(self.wf, query))
 
-        return [{
+    def __cached(self, query):
+        """Translation of ``query`` from the translation store, if newer
+        than ``MAX_AGE_CACHE``. Translations up to ``MAX_STALE_AGE`` old
+        are returned as well, and refreshed in the background.
+        """
+        store = translation_cache.open_store(self.wf)
+        return store.get(self.__cache_key(query), max_age=MAX_AGE_CACHE,
+                         fallback=translation_cache.legacy_key(
+                             'MSFT', self.target_lang, query),
+                         max_stale_age=MAX_STALE_AGE,
+                         refresh=translation_cache.refresh_command(
+                             self.wf, 'MSFT', self.target_lang, query))
+
+    def __cache(self, query, translation):
+        if supersede.is_superseded(self.generation):
+            return  # Alfred has moved on to a newer query
+        store = translation_cache.open_store(self.wf)
+        store.set(self.__cache_key(query), translation, provider='MSFT',
+                  source=self.source_lang, target=self.target_lang,
+                  query=translation_cache.normalize(self.wf, query))
+
+    def __make_item(self, query, translation):
+        from urllib import quote
+        return {
             'title': translation,
-            'subtitle': self.query + ' [msft]',
+            'subtitle': query + ' [msft]',
             'valid': True,
             'arg': translation,
             'copytext': translation,
             'largetext': translation,
             'quicklookurl': QUICK_LOOK_URL + '?'
                             + 'to=' + self.target_lang
-                            + '&text=' + quote(self.query.encode('utf-8')),
-            'icon': MicrosoftTranslate.get_icon(self.target_lang)}]
+                            + '&text=' + quote(query.encode('utf-8')),
+            'icon': MicrosoftTranslate.get_icon(self.target_lang)}
+
+    def cached_translations(self, texts=None):
+        """Translations of :attr:`query` from the cache, without going to
+        the network. Or, if given, of each of ``texts``, as
+        :meth:`translate_many` returns them.
+
+            Returns:
+                A list of translation dictionaries or None if the query
+                (or one of ``texts``) isn't cached.
+        """
+        trans = []
+        for text in texts or [self.query]:
+            translation = self.__cached(text)
+            if translation is None:
+                return None
+            trans.append(self.__make_item(text, translation))
+        return trans
+
+    def fetch_translations(self):
+        """Translation of :attr:`query` from Microsoft, cached for next
+        time. Needs the API key and an access token: only called once the
+        cache has missed.
+
+            Returns:
+                A list with one translation dictionary.
+        """
+        translation = self.__get_translations()
+        self.__cache(self.query, translation)
+        return [self.__make_item(self.query, translation)]
+
+    def get_translations(self):
+        # Get from cache translations newer than MAX_AGE_CACHE
+        translations = self.cached_translations()
+        if translations is None:
+            translations = self.fetch_translations()
+        return translations
+
+    def suggestions(self):
+        """Past translations of queries similar to :attr:`query`, from
+        the translation memory. Shown when Microsoft can't be reached.
+
+            Returns:
+                A list of translation dictionaries, most similar first,
+                with the ``similarity`` (0 to 1) of their query.
+        """
+        store = translation_cache.open_store(self.wf)
+        trans = []
+        for similarity, query, translation in store.similar(
+                'MSFT', self.target_lang,
+                translation_cache.normalize(self.wf, self.query)):
+            tr = self.__make_item(query, translation)
+            tr['subtitle'] = u'{0:.0%} similar: {1}'.format(
+                similarity, tr['subtitle'])
+            tr['similarity'] = similarity
+            trans.append(tr)
+        return trans
+
+    def refresh(self):
+        """Fetch :attr:`query` again and update the cache."""
+        self.__cache(self.query, self.__get_translations())
+
+    @staticmethod
+    def __batches(texts):
+        """``texts`` split into batches within the API's limits."""
+        batches = []
+        for text in texts:
+            if (not batches or len(batches[-1]) == MAX_BATCH
+                    or sum(map(len, batches[-1])) + len(text)
+                    > MAX_BATCH_CHARS):
+                batches.append([])
+            batches[-1].append(text)
+        return batches
+
+    def missing(self, texts):
+        """Those of ``texts`` that aren't cached, or are older than
+        ``MAX_AGE_CACHE``.
+        """
+        keys = [self.__cache_key(text) for text in texts]
+        store = translation_cache.open_store(self.wf)
+        missing = store.missing(keys, MAX_AGE_CACHE)
+        return [text for key, text in zip(keys, texts) if key in missing]
+
+    def prefetch(self, texts):
+        """Translate ``texts`` and cache the translations, batched within
+        the API's limits. For ``--warm``.
+        """
+        for batch in self.__batches(texts):
+            for text, translation in zip(batch, self.__fetch(batch)):
+                self.__cache(text, translation)
+
+    def translate_many(self, texts):
+        """Translate several texts with as few requests as possible.
+
+        Each text is cached separately, under the same key
+        :meth:`get_translations` uses. Only texts missing from the cache
+        are sent to Microsoft, batched within the API's limits.
+
+            Arguments:
+                texts: list of texts to translate
+
+            Returns:
+                A list of translation dictionaries, one per text.
+        """
+        translations = {}
+        misses = []
+        for text in texts:
+            cached = self.__cached(text)
+            if cached is not None:
+                translations[text] = cached
+            elif text not in misses:
+                misses.append(text)
+
+        for batch in self.__batches(misses):
+            for text, translation in zip(batch, self.__fetch(batch)):
+                translations[text] = translation
+                self.__cache(text, translation)
+
+        return [self.__make_item(text, translations[text]) for text in texts]
 
     @staticmethod
     def get_icon(lang_code=None):
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Show what's at hand at once, the translation when it arrives.
+
+On a cache miss, the ``tr`` script filter doesn't wait for the network.
+It answers straight away with what it has (translations cached for other
+services or languages, stale ones and translations of similar queries)
+and a "Translating..." item, and asks Alfred to run it again shortly
+(``rerun``, Alfred 3 feedback). A worker, a background process or a
+thread of the daemon, fetches the translation and writes the final items
+to a result file, which the reruns poll. With several services (or
+target languages), each one's items are added to the file as soon as
+they arrive (:func:`add`), so a slow service doesn't hold back the
+others.
+
+Results are keyed on the query and the services and languages it is
+translated with (:func:`result_key`). A worker that hasn't delivered
+after ``WORKER_TIMEOUT`` seconds is presumed dead: its result is
+discarded and the next run starts over.
+
+Turned off with the ``progressive_results`` setting.
+
+Only imports the workflow library to write results, so ``tr.py`` can
+import it without leaving the standard library.
+"""
+
+import os
+import json
+import time
+import errno
+from hashlib import sha224
+
+RERUN_INTERVAL = 0.2  # in sec., between polls
+WORKER_TIMEOUT = 15  # in sec.
+DIRNAME = 'results'
+# Set to `pending_key` for reruns, so they don't supersede their own
+# worker.
+VARIABLE = 'tr_pending'
+PROPS = {
+    'ENABLED': 'progressive_results',
+}
+
+
+def result_key(apis, query):
+    """Key of the result of translating ``query`` with ``apis``."""
+    fields = [u'{0}:{1}'.format(type(api).__name__, api.target_lang)
+              for api in apis]
+    fields.append(query)
+    return sha224(u'\x1f'.join(fields).encode('utf-8')).hexdigest()
+
+
+def pending_key(query):
+    """Value of ``VARIABLE`` while the result for ``query`` is pending.
+
+    Alfred passes the variable on to every later run of the session, so
+    ``tr.py`` compares it with the key of its own query, which it can
+    compute without the translators (unlike :func:`result_key`).
+    """
+    return sha224(query.encode('utf-8')).hexdigest()
+
+
+def _path(wf, key):
+    dirpath = wf.cachefile(DIRNAME)
+    if not os.path.isdir(dirpath):
+        try:
+            os.makedirs(dirpath)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    return os.path.join(dirpath, key + '.json')
+
+
+def _write(wf, key, record):
+    from workflow.workflow import atomic_writer
+    with atomic_writer(_path(wf, key), 'wb') as file_obj:
+        json.dump(record, file_obj)
+
+
+def status(wf, key):
+    """Result of ``key``.
+
+        Returns:
+            None if no worker has been started (or it has timed out),
+            else a dictionary with the ``started`` time, the
+            ``partial`` items delivered so far (if any) and, once the
+            worker is done, the feedback ``items`` or an ``error``
+            message.
+    """
+    path = _path(wf, key)
+    try:
+        with open(path, 'rb') as file_obj:
+            record = json.load(file_obj)
+    except (IOError, ValueError):
+        return None
+    if time.time() - record['started'] > WORKER_TIMEOUT:
+        discard(wf, key)
+        return None
+    return record
+
+
+def start(wf, key, spawn):
+    """Record that a worker is fetching ``key`` and start it.
+
+        Arguments:
+            wf: Workflow instance
+            key: see :func:`result_key`
+            spawn: function starting the worker, which calls
+                :func:`finish` when done
+    """
+    _write(wf, key, {'started': time.time()})
+    try:
+        spawn()
+    except Exception:
+        discard(wf, key)
+        raise
+
+
+def finish(wf, key, items=None, error=None):
+    """Deliver the result of ``key``: the feedback ``items`` (keyword
+    arguments of ``Workflow.add_item``) or an ``error`` message.
+    """
+    record = status(wf, key) or {'started': time.time()}
+    if error is not None:
+        record['error'] = error
+    else:
+        record['items'] = items
+    _write(wf, key, record)
+
+
+def add(wf, key, items):
+    """Deliver part of the result of ``key``: the feedback ``items`` of
+    one of several services, shown until the worker is done. Ignored if
+    the result has been discarded.
+    """
+    record = status(wf, key)
+    if record is None:
+        return
+    record.setdefault('partial', []).extend(items)
+    _write(wf, key, record)
+
+
+def discard(wf, key):
+    """Forget the result of ``key``."""
+    try:
+        os.unlink(_path(wf, key))
+    except OSError:
+        pass
+
+
+def cleanup(wf):
+    """Delete results nobody has collected.
+
+        Returns:
+            Number of results deleted.
+    """
+    dirpath = wf.cachefile(DIRNAME)
+    try:
+        filenames = os.listdir(dirpath)
+    except OSError:
+        return 0
+    deleted = 0
+    for filename in filenames:
+        path = os.path.join(dirpath, filename)
+        try:
+            if time.time() - os.stat(path).st_mtime > WORKER_TIMEOUT:
+                os.unlink(path)
+                deleted += 1
+        except OSError:
+            pass
+    return deleted
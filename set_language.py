@@ -7,7 +7,7 @@ from workflow import Workflow, ICON_WARNING
 import argparse
 from collections import OrderedDict
 
-from base_translate import GOOGL_API, MSFT_API
+from base_translate import GOOGL_API, MSFT_API, BOTH_API
 from google_translate import PROPS as GOOGLE_PROPS, GoogleTranslate
 from msft_translate import PROPS as MSFT_PROPS, MicrosoftTranslate
 
@@ -20,6 +20,7 @@ class BaseLanguage(object):
         self._languages = None
         self._target_lang_code = None
         self._prop_target_lang = None
+        self._prop_target_langs = None
         self._default_icon = None
 
     @property
@@ -38,6 +39,28 @@ class BaseLanguage(object):
     def target_lang_code(self, value):
         self._wf.settings[self.prop_target_lang] = value
 
+    @property
+    def target_lang_codes(self):
+        return self._wf.settings.get(self._prop_target_langs, None)
+
+    @target_lang_codes.setter
+    def target_lang_codes(self, value):
+        self._wf.settings[self._prop_target_langs] = value
+
+    def find_code(self, text):
+        """Get the code of a language given by its name or code.
+
+            Arguments:
+                text: language name or code, case-insensitive
+
+            Returns:
+                Language code or None if there is no such language.
+        """
+        for (code, name) in self._languages.items():
+            if text.lower() in (code.lower(), name.lower()):
+                return code
+        return None
+
     @property
     def target_lang_name(self):
         """Get full target language name.
@@ -162,6 +185,7 @@ class GoogleLanguage(BaseLanguage):
     def __init__(self, wf):
         super(GoogleLanguage, self).__init__(wf)
         self._prop_target_lang = GOOGLE_PROPS['TARGET_LANG']
+        self._prop_target_langs = GOOGLE_PROPS['TARGET_LANGS']
         self._languages = self.languages
 
     def get_icon(self, lang_code):
@@ -228,12 +252,48 @@ class MicrosoftLanguage(BaseLanguage):
     def __init__(self, wf):
         super(MicrosoftLanguage, self).__init__(wf)
         self._prop_target_lang = MSFT_PROPS['TARGET_LANG']
+        self._prop_target_langs = MSFT_PROPS['TARGET_LANGS']
         self._languages = self.languages
 
     def get_icon(self, lang_code):
         return MicrosoftTranslate.get_icon(lang_code)
 
 
+class CombinedLanguage(BaseLanguage):
+    """Languages supported by both Google and Microsoft Translate."""
+    languages = dict((code, name)
+                     for (code, name) in GoogleLanguage.languages.items()
+                     if code in MicrosoftLanguage.languages)
+
+    def __init__(self, wf):
+        super(CombinedLanguage, self).__init__(wf)
+        self._prop_target_lang = GOOGLE_PROPS['TARGET_LANG']
+        self._languages = self.languages
+
+    @property
+    def target_lang_code(self):
+        return self._wf.settings.get(self.prop_target_lang, None)
+
+    @target_lang_code.setter
+    def target_lang_code(self, value):
+        """Set the target language of both services."""
+        self._wf.settings[GOOGLE_PROPS['TARGET_LANG']] = value
+        self._wf.settings[MSFT_PROPS['TARGET_LANG']] = value
+
+    @property
+    def target_lang_codes(self):
+        return self._wf.settings.get(GOOGLE_PROPS['TARGET_LANGS'], None)
+
+    @target_lang_codes.setter
+    def target_lang_codes(self, value):
+        """Set the target languages of both services."""
+        self._wf.settings[GOOGLE_PROPS['TARGET_LANGS']] = value
+        self._wf.settings[MSFT_PROPS['TARGET_LANGS']] = value
+
+    def get_icon(self, lang_code):
+        return GoogleTranslate.get_icon(lang_code)
+
+
 def main(wf):
     parser = argparse.ArgumentParser()
     parser.add_argument('query', nargs='?', default=None)
@@ -256,20 +316,39 @@ def main(wf):
         api = GoogleLanguage(wf)
     elif api_provider == MSFT_API:
         api = MicrosoftLanguage(wf)
+    elif api_provider == BOTH_API:
+        api = CombinedLanguage(wf)
     else:
         raise RuntimeError('Unsupported API')
 
+    # Several target languages are separated by commas, e.g. "de,fr,ja".
     if args.target_lang:
-        api.target_lang_code = args.target_lang
+        codes = [code.strip() for code in args.target_lang.split(',')
+                 if code.strip()]
+        if not codes:
+            wf.add_item(args.target_lang, 'No matching language found.',
+                        icon=ICON_WARNING, valid=False)
+            wf.send_feedback()
+            return 0
+        with wf.settings.batch():
+            api.target_lang_code = codes[0]
+            api.target_lang_codes = codes
         return 0
 
-    lang = args.query
+    # Languages before the last comma are already chosen, the last one
+    # is being typed.
+    parts = [part.strip() for part in (args.query or '').split(',')]
+    chosen = [code for code in map(api.find_code, parts[:-1]) if code]
+    lang = parts[-1]
     hit = False
-    pattern = re.compile('^' + lang, re.IGNORECASE)
+    pattern = re.compile('^' + re.escape(lang), re.IGNORECASE)
     for (code, name) in api.languages.items():
         if pattern.match(name):
-            wf.add_item(name, code, arg=code, valid=True,
-                        icon=api.get_icon(code))
+            codes = chosen + [code]
+            names = [api.languages[c] for c in codes]
+            wf.add_item(name, ', '.join(codes), arg=','.join(codes),
+                        autocomplete=', '.join(names) + ', ',
+                        valid=True, icon=api.get_icon(code))
             hit = True
     if not hit:
         wf.add_item(lang, "No matching language found.",
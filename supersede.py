@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Latest query wins.
+
+Alfred runs the script filter for every intermediate query ("h", "he",
+"hel", ...) and waits for each run to finish before starting the next,
+only to throw away all but the last result. Each run registers a new
+generation number in the cache directory. A run whose generation is no
+longer the newest one is superseded: it stops before (or while) going to
+the network and neither caches nor outputs anything.
+
+Only uses the standard library, like :mod:`daemon_client`.
+"""
+
+import os
+import fcntl
+import threading
+
+FILENAME = 'query_generation'
+CHECK_INTERVAL = 0.05  # in sec.
+
+
+class Superseded(Exception):
+    """Raised when a newer query has been registered."""
+
+
+def generation_path():
+    """Path to the file holding the newest generation.
+
+    Alfred tells the workflow its cache directory in
+    ``alfred_workflow_cache``. Outside Alfred, the temporary directory is
+    used.
+    """
+    cachedir = os.getenv('alfred_workflow_cache')
+    if not cachedir:
+        return os.path.join(os.getenv('TMPDIR', '/tmp'),
+                            '{0}.{1}'.format(FILENAME, os.getuid()))
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+    return os.path.join(cachedir, FILENAME)
+
+
+def _read(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    try:
+        return int(os.read(fd, 32) or 0)
+    except ValueError:
+        return 0
+
+
+def register():
+    """Register a new query.
+
+        Returns:
+            Generation number of the query.
+    """
+    fd = os.open(generation_path(), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        generation = _read(fd) + 1
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, str(generation))
+        return generation
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def newest():
+    """Generation number of the newest query, 0 if there is none."""
+    try:
+        fd = os.open(generation_path(), os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        return _read(fd)
+    finally:
+        os.close(fd)
+
+
+def is_superseded(generation):
+    """Whether a newer query than ``generation`` has been registered.
+
+    A ``generation`` of None is never superseded.
+    """
+    return generation is not None and newest() != generation
+
+
+def check(generation):
+    """Raise :class:`Superseded` if ``generation`` is superseded."""
+    if is_superseded(generation):
+        raise Superseded('Query {0} superseded'.format(generation))
+
+
+def call(generation, func, *args):
+    """Return ``func(*args)``, unless ``generation`` is superseded first.
+
+    ``func`` runs in a thread of its own while the caller checks the
+    generation every ``CHECK_INTERVAL`` seconds. As soon as it is
+    superseded, :class:`Superseded` is raised and the thread is left to
+    finish in the background: as a daemon thread, it doesn't keep the
+    process alive, and translators don't cache the results of
+    superseded queries. Exceptions raised by ``func`` are raised again
+    in the caller. A ``generation`` of None just calls ``func``.
+
+    Nothing interrupts ``func`` itself, so its socket timeouts apply as
+    usual. (Under Python 2, a socket wait interrupted by a signal starts
+    over, so a timer signal checking the generation kept requests from
+    ever timing out.)
+    """
+    if generation is None:
+        return func(*args)
+    check(generation)
+    outcome = []
+
+    def target():
+        try:
+            outcome.append((func(*args), None))
+        except Exception as e:
+            outcome.append((None, e))
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    while True:
+        thread.join(CHECK_INTERVAL)
+        if not thread.is_alive():
+            break
+        check(generation)
+
+    result, error = outcome[0]
+    if error is not None:
+        raise error
+    return result
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local stand-in for the Google and Microsoft translation APIs.
+
+Emulates the endpoints the workflow uses, with deterministic fake
+translations (the text reversed, prefixed with the target language):
+
+    GET/POST /language/translate/v2       Google Translate v2
+    POST     /sts/v1.0/issueToken         Microsoft access token
+    POST     /translate?api-version=3.0   Microsoft Translator v3
+
+Point the workflow at it with these workflow variables (or environment
+variables):
+
+    google_api_url  http://127.0.0.1:8765/language/translate/v2
+    msft_api_url    http://127.0.0.1:8765/translate
+    msft_token_url  http://127.0.0.1:8765/sts/v1.0/issueToken
+
+Faults are injected at random (see ``--seed``): latency, HTTP errors,
+bodies sent a few bytes at a time and connections reset before the
+reply. For example:
+
+    python tools/stub_server.py --latency lognormal:4:0.5 \\
+        --error 429=0.05 --error 503=0.02 --trickle 0.1 --reset 0.01
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import time
+import random
+import socket
+import struct
+import argparse
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+GOOGLE_PATH = '/language/translate/v2'
+TOKEN_PATH = '/sts/v1.0/issueToken'
+MSFT_PATH = '/translate'
+ERROR_CODES = (400, 401, 403, 429, 500, 502, 503)
+TRICKLE_CHUNK = 16  # in bytes
+
+
+def fake_translation(text, target):
+    """Deterministic translation of ``text`` into ``target``."""
+    return u'{0}: {1}'.format(target, text[::-1])
+
+
+def parse_latency(spec):
+    """Latency distribution from ``spec``, in milliseconds.
+
+        Arguments:
+            spec: ``fixed:MS``, ``uniform:MIN:MAX``, ``normal:MEAN:SD``,
+                ``lognormal:MU:SIGMA`` or ``exp:MEAN``
+
+        Returns:
+            Function taking a ``random.Random`` and returning a latency in
+            seconds.
+    """
+    name, _, args = spec.partition(':')
+    try:
+        args = [float(arg) for arg in args.split(':') if arg]
+        draw = {
+            'fixed': lambda rng, ms: ms,
+            'uniform': lambda rng, lo, hi: rng.uniform(lo, hi),
+            'normal': lambda rng, mean, sd: rng.normalvariate(mean, sd),
+            'lognormal': lambda rng, mu, sigma: rng.lognormvariate(mu, sigma),
+            'exp': lambda rng, mean: rng.expovariate(1 / mean),
+        }[name]
+        draw(random.Random(), *args)  # check the arguments
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        raise argparse.ArgumentTypeError('invalid latency: ' + spec)
+    return lambda rng: max(draw(rng, *args), 0) / 1000
+
+
+def parse_error(spec):
+    """``CODE=RATE`` as a ``(code, rate)`` tuple."""
+    try:
+        code, rate = spec.split('=')
+        code, rate = int(code), float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid error rate: ' + spec)
+    if code not in ERROR_CODES:
+        raise argparse.ArgumentTypeError(
+            'error code must be one of ' + ', '.join(map(str, ERROR_CODES)))
+    return code, rate
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real APIs
+    responses = dict(BaseHTTPServer.BaseHTTPRequestHandler.responses)
+    responses[429] = ('Too Many Requests', 'Rate limit exceeded')
+
+    def do_GET(self):
+        self.handle_api()
+
+    def do_POST(self):
+        self.handle_api()
+
+    def log_message(self, fmt, *args):
+        if not self.server.quiet:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, fmt, *args)
+
+    def handle_api(self):
+        url = urlparse.urlsplit(self.path)
+        params = urlparse.parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+
+        faults = self.server.draw_faults()
+        time.sleep(faults['latency'])
+        if faults['reset']:
+            return self.reset()
+        if faults['error']:
+            return self.send_error(faults['error'])
+
+        if url.path == GOOGLE_PATH:
+            if self.command == 'POST':
+                params.update(urlparse.parse_qs(body))
+            self.google(params)
+        elif url.path == TOKEN_PATH and self.command == 'POST':
+            self.token(params)
+        elif url.path == MSFT_PATH and self.command == 'POST':
+            self.msft(params, body)
+        else:
+            self.send_error(404)
+
+    def google(self, params):
+        if not params.get('key') or not params.get('target'):
+            return self.send_error(400)
+        target = params['target'][0]
+        self.reply({'data': {'translations': [
+            {'translatedText': fake_translation(q.decode('utf-8'), target),
+             'detectedSourceLanguage': 'en'}
+            for q in params.get('q', [])]}})
+
+    def token(self, params):
+        if not (params.get('Subscription-Key') or
+                self.headers.get('Ocp-Apim-Subscription-Key')):
+            return self.send_error(401)
+        self.reply('stub-token-{0}'.format(int(time.time())),
+                   'text/plain')
+
+    def msft(self, params, body):
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.send_error(401)
+        try:
+            texts = [item['Text'] for item in json.loads(body)]
+            target = params['to'][0]
+        except (ValueError, KeyError, TypeError):
+            return self.send_error(400)
+        self.reply([{'translations': [{'text': fake_translation(text, target),
+                                       'to': target}]}
+                    for text in texts])
+
+    def reply(self, data, content_type='application/json; charset=UTF-8'):
+        body = data if isinstance(data, str) else json.dumps(data)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.trickle():
+            for i in range(0, len(body), TRICKLE_CHUNK):
+                self.wfile.write(body[i:i + TRICKLE_CHUNK])
+                self.wfile.flush()
+                time.sleep(self.server.trickle_delay)
+        else:
+            self.wfile.write(body)
+
+    def reset(self):
+        """Drop the connection with a TCP reset."""
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                   struct.pack('ii', 1, 0))
+        self.close_connection = 1
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=None, errors=(), trickle_rate=0,
+                 trickle_delay=0.05, reset_rate=0, seed=None, quiet=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.errors = list(errors)
+        self.trickle_rate = trickle_rate
+        self.trickle_delay = trickle_delay
+        self.reset_rate = reset_rate
+        self.quiet = quiet
+        self._random = random.Random(seed)
+
+    def draw_faults(self):
+        """Latency and fault of the next request."""
+        rng = self._random
+        error = None
+        draw = rng.random()
+        for code, rate in self.errors:
+            if draw < rate:
+                error = code
+                break
+            draw -= rate
+        return {
+            'latency': self.latency(rng) if self.latency else 0,
+            'reset': rng.random() < self.reset_rate,
+            'error': error,
+        }
+
+    def trickle(self):
+        """Whether to send the next reply body slowly."""
+        return self._random.random() < self.trickle_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=parse_latency, default=None,
+                        help='latency distribution in ms, e.g. fixed:50, '
+                             'uniform:20:200, normal:100:30, '
+                             'lognormal:4:0.5, exp:80')
+    parser.add_argument('--error', type=parse_error, action='append',
+                        default=[], metavar='CODE=RATE',
+                        help='reply with HTTP error CODE to this fraction '
+                             'of requests (repeatable)')
+    parser.add_argument('--trickle', type=float, default=0, metavar='RATE',
+                        help='fraction of replies sent {0} bytes at a '
+                             'time'.format(TRICKLE_CHUNK))
+    parser.add_argument('--trickle-delay', type=float, default=0.05,
+                        metavar='SEC', help='delay between trickled chunks')
+    parser.add_argument('--reset', type=float, default=0, metavar='RATE',
+                        help='fraction of connections reset before replying')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed for reproducible faults')
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't log requests")
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), latency=args.latency,
+                        errors=args.error, trickle_rate=args.trickle,
+                        trickle_delay=args.trickle_delay,
+                        reset_rate=args.reset, seed=args.seed,
+                        quiet=args.quiet)
+    print('Listening on http://{0}:{1}'.format(args.host, args.port),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Entry point of the ``tr`` script filter.
+
+Forwards plain queries to the resident daemon (``translate_daemon.py``)
+via :mod:`daemon_client`. Only if the daemon isn't running (or for
+magic arguments) is ``base_translate`` imported, and with it the
+workflow library, the translators and the cache.
+
+Only uses the standard library, like :mod:`daemon_client`.
+"""
+
+import os
+import sys
+import unicodedata
+
+import daemon_client
+import progressive
+import supersede
+
+
+def main(args):
+    """Run the script filter with command line ``args``.
+
+        Returns:
+            Exit status.
+    """
+    generation = None
+    if daemon_client.is_query(args):
+        # Alfred re-running the script filter to poll for a result (see
+        # `progressive`) mustn't supersede the query's worker. Alfred
+        # keeps the variable for the rest of the session, so it only
+        # counts if it is this query's. Decoded as `Workflow.args` does.
+        query = unicodedata.normalize('NFC', args[0].decode('utf-8'))
+        if os.getenv(progressive.VARIABLE) == progressive.pending_key(query):
+            generation = supersede.newest()
+        else:
+            generation = supersede.register()
+        status = daemon_client.forward(args, generation)
+        if status is not None:
+            return status
+
+    import base_translate
+    return base_translate.run(generation)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Resident translation daemon.
+
+Alfred starts a new Python process for every keystroke in the ``tr``
+script filter. The daemon keeps a :class:`Workflow3` (settings, logger,
+credentials) warm between keystrokes and serves queries over a Unix
+socket. ``tr.py``, the script filter's entry point, forwards plain
+queries to it via :mod:`daemon_client` and falls back to translating
+in-process with ``base_translate`` if the daemon isn't running.
+
+The daemon is started on demand and exits after ``daemon_idle_timeout``
+seconds (setting) without requests, or when asked to
+(:func:`daemon_client.stop`). While running, it also schedules
+the workflow's update checks, once a day, so keystrokes don't have to.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import SocketServer
+from StringIO import StringIO
+
+import base_translate
+import credentials
+import daemon_client
+import translation_cache
+from workflow import Workflow3, PasswordNotFound
+
+IDLE_TIMEOUT = 60*10  # in sec.
+UPDATE_CHECK_INTERVAL = 60*60*24  # in sec.
+PROPS = {
+    'IDLE_TIMEOUT': 'daemon_idle_timeout',
+}
+
+
+class DaemonWorkflow(Workflow3):
+    """:class:`Workflow3` whose settings can be reloaded."""
+
+    def reload_settings(self):
+        """Re-read ``settings.json`` on next access."""
+        self._settings = None
+
+    def forget(self):
+        """Drop remembered API keys and settings."""
+        credentials.provider(self).forget()
+        self.reload_settings()
+
+    def reset_items(self):
+        """Discard feedback items and variables of the previous run."""
+        self._items = []
+        self.variables = {}
+        self.rerun = 0
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        command = request.get('command')
+        if command == 'run':
+            status, output = self.server.run(request['args'],
+                                             request.get('generation'))
+            reply = {'status': status, 'output': output}
+        elif command == 'credential':
+            try:
+                secret = credentials.get(self.server.wf, request['account'])
+            except PasswordNotFound:
+                secret = None
+            reply = {'secret': secret}
+        else:
+            if command == 'reset':
+                self.server.wf.forget()
+            elif command == 'stop':
+                self.server.stopped = True
+            reply = {'status': 0, 'output': u''}
+        self.wfile.write(json.dumps(reply))
+
+
+class TranslationServer(SocketServer.UnixStreamServer):
+    """Runs ``base_translate.main`` for each request with a shared
+    :class:`DaemonWorkflow`.
+    """
+
+    def __init__(self, wf, path):
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.wf = wf
+        self.idle = False
+        self.stopped = False
+        self.preconnect = False
+
+    def handle_timeout(self):
+        self.idle = True
+
+    def run(self, args, generation=None):
+        """Run ``base_translate.main`` with ``args`` as command line and
+        ``generation`` as query generation.
+
+            Returns:
+                Exit status and the feedback written to stdout.
+        """
+        # Pick up changes by other processes (tr-setlang etc.).
+        self.wf.settings.revalidate()
+        translation_cache.revalidate()
+        # Alfred runs the script filter with an empty query as soon as
+        # `tr` is typed: get connections ready for the real query.
+        self.preconnect = args == ['']
+        self.wf.reset_items()
+        base_translate.generation = generation
+        sys.argv = sys.argv[:1] + args
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            status = self.wf.run(base_translate.main)
+        except SystemExit as e:
+            status = e.code
+        finally:
+            sys.stdout = stdout
+        return status, output.getvalue().decode('utf-8')
+
+
+def main(wf):
+    path = daemon_client.socket_path()
+    if daemon_client.ping():
+        log.debug('Daemon already listening on ' + path)
+        return 0
+    if os.path.exists(path):
+        os.unlink(path)  # left behind by a dead daemon
+
+    # Only the current user may talk to the daemon.
+    umask = os.umask(0o077)
+    try:
+        server = TranslationServer(wf, path)
+    finally:
+        os.umask(umask)
+    server.timeout = wf.settings.get(PROPS['IDLE_TIMEOUT'], IDLE_TIMEOUT)
+    # Keep API keys in memory, straight from the backend: processes
+    # asking the daemon for keys mustn't make it ask itself.
+    credentials.use(credentials.CachedProvider(
+        credentials.backend(wf),
+        wf.settings.get(credentials.PROPS['TTL'], credentials.CACHE_TTL)))
+
+    # Clean up the socket when killed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    log.debug('Daemon listening on ' + path)
+    try:
+        base_translate.preconnect(wf)
+        next_update_check = 0
+        next_gc = 0
+        while not (server.idle or server.stopped):
+            server.handle_request()
+            # After the reply has been sent.
+            if server.preconnect:
+                base_translate.preconnect(wf)
+                server.preconnect = False
+            translation_cache.open_store(wf).flush_stats()
+            if time.time() >= next_update_check:
+                base_translate.schedule_update(wf)
+                next_update_check = time.time() + UPDATE_CHECK_INTERVAL
+            if time.time() >= next_gc:
+                translation_cache.schedule_gc(wf)
+                next_gc = time.time() + translation_cache.GC_INTERVAL
+    finally:
+        server.server_close()
+        os.unlink(path)
+        translation_cache.open_store(wf).flush_stats(force=True)
+    if server.stopped:
+        log.debug('Daemon stopped on request')
+    else:
+        log.debug('Daemon idle for {0}s, exiting'.format(server.timeout))
+
+
+if __name__ == '__main__':
+    wf = DaemonWorkflow()
+    log = wf.logger
+    base_translate.log = log
+    base_translate.fetch_in_thread = True
+    sys.exit(wf.run(main))
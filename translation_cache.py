@@ -0,0 +1,605 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""SQLite store for translations.
+
+All translations live in a single database in the workflow's cache
+directory instead of one pickle file per query. Entries are looked up by
+their cache key (the primary key), carry their own creation time for age
+checks and are evicted least recently used first once the store grows
+beyond ``cache_max_entries`` entries or ``cache_max_bytes`` bytes
+(settings). Eviction runs in the background (``base_translate.py --gc``,
+see :func:`schedule_gc`), never while a query is answered.
+
+Queries are normalized before keys are derived from them, so "hello",
+"hello " and NFD variants share one entry ("Hello" too, with the
+``cache_fold_case`` setting on). The store counts hits and misses;
+``tr --stats`` shows them. Counts and access times are kept in memory,
+so a cache hit doesn't write to the database. They're written along
+with new translations and by the daemon every ``STATS_INTERVAL``
+seconds. Other processes append them to a pending file when they exit,
+which the next write to the database takes in.
+
+The normalized queries are indexed by word and character trigram. This
+translation memory finds past translations of similar queries, to show
+when the translation services can't be reached.
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import atexit
+import sqlite3
+import threading
+from hashlib import sha224
+
+DB_NAME = 'translations.sqlite'
+MAX_ENTRIES = 10000
+MAX_BYTES = 1024*1024*10
+TOUCH_INTERVAL = 60  # in sec., between updates of an access time
+STATS_INTERVAL = 60  # in sec., between writes of counts and access times
+# Counts and access times of processes that have exited, one JSON
+# object per line, until they're written to the database.
+PENDING_NAME = 'translations.pending'
+GC_INTERVAL = 60*10  # in sec., between evictions
+GC_BATCH = 200  # entries evicted per transaction
+GC_MARKER = 'cache_gc'
+PROPS = {
+    'MAX_ENTRIES': 'cache_max_entries',
+    'MAX_BYTES': 'cache_max_bytes',
+    'FOLD_CASE': 'cache_fold_case',
+}
+# Separates the fields of a cache key: can't be typed into Alfred.
+KEY_SEPARATOR = u'\x1f'
+MAX_SUGGESTIONS = 5
+MIN_SIMILARITY = 0.4  # of suggestions, see `TranslationCache.similar`
+SCHEMA_VERSION = 1
+# Cache files written by `Workflow.cached_data` for translations.
+LEGACY_FILE = re.compile(r'^[0-9a-f]{56}\.cpickle$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    key TEXT PRIMARY KEY,
+    provider TEXT,
+    source TEXT,
+    target TEXT,
+    query TEXT,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS translations_query
+    ON translations (provider, source, target, query);
+CREATE INDEX IF NOT EXISTS translations_accessed
+    ON translations (accessed);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS grams (
+    gram TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (gram, key)
+);
+CREATE INDEX IF NOT EXISTS grams_key ON grams (key);
+"""
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def normalize(wf, query):
+    """Canonical form of ``query`` for cache keys.
+
+    Unicode NFC, runs of whitespace collapsed into one space and, if the
+    ``cache_fold_case`` setting is on, single words lowercased. Off by
+    default: "US" and "us" or "Turkey" and "turkey" translate
+    differently.
+
+        Arguments:
+            wf: Workflow instance
+            query: query as typed
+
+        Returns:
+            Normalized query.
+    """
+    query = u' '.join(wf.decode(query, normalization='NFC').split())
+    if u' ' not in query and wf.settings.get(PROPS['FOLD_CASE'], False):
+        query = query.lower()
+    return query
+
+
+def cache_key(provider, source, target, query):
+    """Key of a translation of ``query`` (normalized) from ``source`` to
+    ``target`` language by ``provider``.
+    """
+    fields = [provider, source or u'', target, query]
+    return sha224(KEY_SEPARATOR.join(fields).encode('utf-8')).hexdigest()
+
+
+def grams(query):
+    """Words and character trigrams of ``query`` (normalized), for the
+    translation memory.
+
+        Returns:
+            A set of strings, words prefixed with ``w:`` and trigrams with
+            ``t:``.
+    """
+    words = query.lower().split()
+    result = set(u'w:' + word for word in words)
+    for word in words:
+        padded = u' ' + word + u' '
+        result.update(u't:' + padded[i:i + 3]
+                      for i in range(len(padded) - 2))
+    return result
+
+
+def refresh_command(wf, provider, target, query):
+    """Command that fetches the translation of ``query`` again and
+    updates the store (``base_translate.py --refresh``).
+    """
+    return ['/usr/bin/env', 'python', wf.workflowfile('base_translate.py'),
+            '--refresh', provider, target, query.encode('utf-8')]
+
+
+def legacy_key(provider, target, query):
+    """Key the translation of ``query`` had before queries were
+    normalized.
+    """
+    return sha224((provider + target + query).encode('utf-8')).hexdigest()
+
+
+def schedule_gc(wf):
+    """Evict old entries in the background (``base_translate.py --gc``)
+    if the last time was more than ``GC_INTERVAL`` seconds ago. Costs one
+    ``stat`` if not.
+    """
+    marker = wf.cachefile(GC_MARKER)
+    try:
+        if time.time() - os.stat(marker).st_mtime < GC_INTERVAL:
+            return
+    except OSError:
+        pass
+    with open(marker, 'a'):
+        os.utime(marker, None)
+    from workflow.background import run_in_background
+    run_in_background('cache_gc', [
+        '/usr/bin/env', 'python', wf.workflowfile('base_translate.py'),
+        '--gc'])
+
+
+def open_store(wf):
+    """The :class:`TranslationCache` of workflow ``wf``.
+
+    The store is opened once per process, and only then is the database
+    looked for: see :func:`revalidate`. Opening it for the first time
+    moves existing pickled translations into it.
+
+        Arguments:
+            wf: Workflow instance
+
+        Returns:
+            A :class:`TranslationCache`.
+    """
+    path = wf.cachefile(DB_NAME)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            migrate = not os.path.exists(path)
+            if migrate and not os.path.isdir(os.path.dirname(path)):
+                # Deleted while the daemon was running
+                os.makedirs(os.path.dirname(path))
+            store = TranslationCache(path)
+            if migrate:
+                store.migrate(wf.cachedir)
+            _stores[path] = store
+            atexit.register(store.save_pending)
+    store.max_entries = wf.settings.get(PROPS['MAX_ENTRIES'], MAX_ENTRIES)
+    store.max_bytes = wf.settings.get(PROPS['MAX_BYTES'], MAX_BYTES)
+    return store
+
+
+def revalidate():
+    """Forget stores whose database has been deleted (e.g. by
+    ``workflow:delcache``), so :func:`open_store` opens them anew.
+    Called by the daemon before each request.
+    """
+    with _stores_lock:
+        for path in list(_stores):
+            if not os.path.exists(path):
+                del _stores[path]
+
+
+class TranslationCache(object):
+    """Translations keyed on provider, source and target language and
+    query, with LRU eviction.
+
+    Values are anything JSON can represent. A store may be shared by
+    several threads.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {}  # not yet written to the database
+        self._touched = {}  # access times by key, ditto
+        self._flushed = time.time()
+        self._pending_path = os.path.join(os.path.dirname(path),
+                                          PENDING_NAME)
+        self._conn = sqlite3.connect(path, timeout=5,
+                                     check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            self._index_all()
+
+    def get(self, key, max_age=0, fallback=None, max_stale_age=0,
+            refresh=None):
+        """Cached value of ``key`` if younger than ``max_age`` seconds.
+
+        With ``max_stale_age`` and ``refresh``, a value older than
+        ``max_age`` but younger than ``max_stale_age`` seconds is returned
+        as well, and ``refresh`` is run in the background to fetch it
+        again (see :meth:`Workflow.cached_data`).
+
+            Arguments:
+                key: cache key
+                max_age: maximum age in seconds, 0 for any age
+                fallback: key to look up if ``key`` isn't cached, e.g.
+                    its :func:`legacy_key`. A value found under it is
+                    moved to ``key``.
+                max_stale_age: maximum age of stale values in seconds
+                refresh: command that fetches the value again, see
+                    :func:`refresh_command`
+
+            Returns:
+                The cached value or None.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._select(key)
+            legacy = row is None and fallback
+            if legacy:
+                row = self._select(fallback)
+                if row is not None:
+                    with self._conn:
+                        self._conn.execute(
+                            'UPDATE OR REPLACE translations SET key = ? '
+                            'WHERE key = ?', (key, fallback))
+            if row is None:
+                self._count('misses')
+                return None
+            value, created, accessed = row
+            stale = max_age and now - created >= max_age
+            if stale and not (refresh and now - created < max_stale_age):
+                self._count('misses')
+                return None
+            if stale:
+                self._count('stale_hits')
+            else:
+                self._count('legacy_hits' if legacy else 'hits')
+            if now - accessed > TOUCH_INTERVAL:
+                self._touched[key] = now
+        if stale:
+            from workflow.background import run_in_background
+            run_in_background('refresh_translation_' + key, refresh)
+        return json.loads(value)
+
+    def missing(self, keys, max_age=0):
+        """Those of ``keys`` not in the store, or older than ``max_age``
+        seconds. Unlike :meth:`get`, neither counted as hits or misses nor
+        refreshed.
+
+            Arguments:
+                keys: cache keys
+                max_age: maximum age in seconds, 0 for any age
+
+            Returns:
+                A set of keys.
+        """
+        keys = list(keys)
+        since = time.time() - max_age if max_age else 0
+        found = set()
+        with self._lock:
+            for i in range(0, len(keys), 900):  # SQLite allows 999
+                lookup = keys[i:i + 900]
+                found.update(key for key, in self._conn.execute(
+                    'SELECT key FROM translations WHERE key IN ({0}) '
+                    'AND created > ?'.format(', '.join('?' * len(lookup))),
+                    lookup + [since]))
+        return set(keys) - found
+
+    def _select(self, key):
+        return self._conn.execute(
+            'SELECT value, created, accessed FROM translations '
+            'WHERE key = ?', (key,)).fetchone()
+
+    def set(self, key, value, provider=None, source=None, target=None,
+            query=None):
+        """Store ``value`` under ``key``. The store may grow beyond its
+        limits until the next :meth:`gc`.
+
+            Arguments:
+                key: cache key
+                value: data to cache
+                provider, source, target, query: what ``key`` was
+                    derived from
+        """
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO translations VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, provider, source, target, query, data, len(data),
+                     now, now))
+                self._index(key, query)
+                self._write_stats()
+
+    def delete(self, key):
+        """Remove ``key`` from the store."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute('DELETE FROM translations WHERE key = ?',
+                                   (key,))
+                self._conn.execute('DELETE FROM grams WHERE key = ?', (key,))
+
+    def _count(self, name, value=1):
+        self._stats[name] = self._stats.get(name, 0) + value
+
+    def _write_stats(self):
+        self._take_pending()
+        for name, value in self._stats.items():
+            self._conn.execute('INSERT OR IGNORE INTO stats VALUES (?, 0)',
+                               (name,))
+            self._conn.execute('UPDATE stats SET value = value + ? '
+                               'WHERE name = ?', (value, name))
+        self._conn.executemany(
+            'UPDATE translations SET accessed = MAX(accessed, ?) '
+            'WHERE key = ?',
+            [(accessed, key) for key, accessed in self._touched.items()])
+        self._stats.clear()
+        self._touched.clear()
+        self._flushed = time.time()
+
+    def flush_stats(self, force=False):
+        """Write hit and miss counts and access times to the database.
+
+        They're kept in memory until the next :meth:`set` or a call of
+        this method more than ``STATS_INTERVAL`` seconds after the last
+        write, so a cache hit doesn't cost a write. With ``force``, they
+        and those other processes left in the pending file are written
+        at once.
+        """
+        with self._lock:
+            if not force and not (self._stats or self._touched):
+                return
+            if not force and time.time() - self._flushed < STATS_INTERVAL:
+                return
+            with self._conn:
+                self._write_stats()
+
+    def save_pending(self):
+        """Append the counts and access times not yet written to the
+        database to the pending file, at exit. A line appended under an
+        exclusive lock costs less than a transaction, and the next write
+        to the database takes it in.
+        """
+        with self._lock:
+            if not (self._stats or self._touched):
+                return
+            line = json.dumps({'counts': self._stats,
+                               'touched': self._touched}) + '\n'
+            try:
+                with open(self._pending_path, 'a') as file_obj:
+                    fcntl.flock(file_obj, fcntl.LOCK_EX)
+                    file_obj.write(line)
+            except IOError:  # cache directory deleted
+                return
+            self._stats.clear()
+            self._touched.clear()
+
+    def _take_pending(self):
+        """Add the counts and access times in the pending file to those
+        in memory, and empty it.
+        """
+        try:
+            file_obj = open(self._pending_path, 'r+')
+        except IOError:
+            return
+        with file_obj:
+            fcntl.flock(file_obj, fcntl.LOCK_EX)
+            lines = file_obj.readlines()
+            file_obj.seek(0)
+            file_obj.truncate()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            for name, value in record['counts'].items():
+                self._count(name, value)
+            for key, accessed in record['touched'].items():
+                self._touched[key] = max(accessed,
+                                         self._touched.get(key, 0))
+
+    def stats(self):
+        """Hit and miss counts and size of the store.
+
+            Returns:
+                Dictionary with ``hits``, ``misses``, ``legacy_hits``
+                (hits on keys from before queries were normalized),
+                ``stale_hits``, ``entries`` and ``bytes``, and
+                ``gc_runs``, ``gc_entries`` and ``gc_bytes``: how often
+                :meth:`gc` evicted entries, and how many in total.
+        """
+        self.flush_stats(force=True)
+        with self._lock:
+            stats = dict.fromkeys(
+                ['hits', 'misses', 'legacy_hits', 'stale_hits', 'gc_runs',
+                 'gc_entries', 'gc_bytes'], 0)
+            stats.update(self._conn.execute('SELECT name, value FROM stats'))
+            entries, size = self._conn.execute(
+                'SELECT COUNT(*), TOTAL(size) FROM translations').fetchone()
+        stats.update(entries=entries, bytes=int(size))
+        return stats
+
+    def _index(self, key, query):
+        """Add ``query`` to the translation memory under ``key``."""
+        self._conn.execute('DELETE FROM grams WHERE key = ?', (key,))
+        if query:
+            self._conn.executemany('INSERT INTO grams VALUES (?, ?)',
+                                   [(gram, key) for gram in grams(query)])
+
+    def _index_all(self):
+        """Build the translation memory from the queries in the store."""
+        with self._lock:
+            with self._conn:
+                rows = self._conn.execute(
+                    'SELECT key, query FROM translations '
+                    'WHERE query IS NOT NULL').fetchall()
+                for key, query in rows:
+                    self._index(key, query)
+                self._conn.execute(
+                    'PRAGMA user_version = {0:d}'.format(SCHEMA_VERSION))
+
+    def similar(self, provider, target, query, limit=MAX_SUGGESTIONS):
+        """Translations of the queries most similar to ``query``.
+
+        Candidates share words or trigrams with ``query``. They're ranked
+        by the Dice coefficient of both sets of :func:`grams`, and those
+        below ``MIN_SIMILARITY`` are left out.
+
+            Arguments:
+                provider: translation service
+                target: target language
+                query: normalized query
+                limit: maximum number of results
+
+            Returns:
+                A list of ``(similarity, query, value)`` tuples, most
+                similar first.
+        """
+        query_grams = grams(query)
+        if not query_grams:
+            return []
+        lookup = list(query_grams)[:900]  # SQLite allows 999 parameters
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT t.query, t.value, COUNT(*) AS shared '
+                'FROM grams AS g JOIN translations AS t ON t.key = g.key '
+                'WHERE g.gram IN ({0}) AND t.provider = ? AND t.target = ? '
+                'GROUP BY g.key ORDER BY shared DESC LIMIT ?'.format(
+                    ', '.join('?' * len(lookup))),
+                lookup + [provider, target, limit * 4]).fetchall()
+
+        results = []
+        for other, value, shared in rows:
+            similarity = 2.0 * shared / (len(query_grams) + len(grams(other)))
+            if similarity >= MIN_SIMILARITY:
+                results.append((similarity, other, json.loads(value)))
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:limit]
+
+    def gc(self, batch=GC_BATCH):
+        """Delete least recently used entries until the store is within
+        ``max_entries`` and ``max_bytes``.
+
+        Entries are deleted ``batch`` at a time, each batch in its own
+        transaction, so processes answering queries don't wait long for
+        the database.
+
+            Returns:
+                Dictionary with the number of ``entries`` and ``bytes``
+                reclaimed.
+        """
+        # Evict by the latest access times.
+        self.flush_stats(force=True)
+        reclaimed = {'entries': 0, 'bytes': 0}
+        while True:
+            with self._lock:
+                with self._conn:
+                    entries, size = self._evict(batch)
+            if not entries:
+                break
+            reclaimed['entries'] += entries
+            reclaimed['bytes'] += int(size)
+        if reclaimed['entries']:
+            self._count('gc_runs')
+            self._count('gc_entries', reclaimed['entries'])
+            self._count('gc_bytes', reclaimed['bytes'])
+            self.flush_stats(force=True)
+        return reclaimed
+
+    def _evict(self, limit):
+        """Delete up to ``limit`` least recently used entries, as far as
+        needed to get within ``max_entries`` and ``max_bytes``.
+
+            Returns:
+                Number of entries and bytes deleted.
+        """
+        entries, size = self._conn.execute(
+            'SELECT COUNT(*), TOTAL(size) FROM translations').fetchone()
+        doomed = []
+        reclaimed = 0
+        for key, entry_size in self._conn.execute(
+                'SELECT key, size FROM translations ORDER BY accessed '
+                'LIMIT ?', (limit,)):
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            doomed.append((key,))
+            entries -= 1
+            size -= entry_size
+            reclaimed += entry_size
+        self._conn.executemany('DELETE FROM translations WHERE key = ?',
+                               doomed)
+        self._conn.executemany('DELETE FROM grams WHERE key = ?', doomed)
+        return len(doomed), reclaimed
+
+    def migrate(self, cachedir):
+        """Move translations cached by ``Workflow.cached_data`` into the
+        store.
+
+        The pickle files only hold the translations, so entries keep
+        their old key and modification time, and the provider is told
+        from the type of the data.
+
+            Arguments:
+                cachedir: directory with the ``.cpickle`` files
+        """
+        import cPickle
+        rows = []
+        paths = []
+        for filename in os.listdir(cachedir):
+            if not LEGACY_FILE.match(filename):
+                continue
+            path = os.path.join(cachedir, filename)
+            try:
+                with open(path, 'rb') as file_obj:
+                    value = cPickle.load(file_obj)
+                mtime = os.stat(path).st_mtime
+            except (IOError, OSError, cPickle.UnpicklingError, EOFError):
+                continue
+            provider = 'GOOGL' if isinstance(value, list) else 'MSFT'
+            data = json.dumps(value)
+            rows.append((filename[:-len('.cpickle')], provider, data,
+                         len(data), mtime, mtime))
+            paths.append(path)
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO translations '
+                    '(key, provider, value, size, created, accessed) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass  # already migrated by another process
@@ -23,13 +23,12 @@
 
 from __future__ import print_function, unicode_literals
 
+# `web`, `subprocess` and `tempfile` are imported where they're used:
+# :class:`Version` is needed on every run, updates are rare.
 import os
-import tempfile
 import re
-import subprocess
 
 import workflow
-import web
 
 # __all__ = []
 
@@ -207,11 +206,13 @@ def download_workflow(url):
             not filename.endswith('.alfredworkflow')):
         raise ValueError('Attachment `{0}` not a workflow'.format(filename))
 
+    import tempfile
     local_path = os.path.join(tempfile.gettempdir(), filename)
 
     wf().logger.debug(
         'Downloading updated workflow from `%s` to `%s` ...', url, local_path)
 
+    import web
     response = web.get(url)
 
     with open(local_path, 'wb') as output:
@@ -311,6 +312,7 @@ def get_valid_releases(github_slug, prereleases=False):
     def retrieve_releases():
         wf().logger.info(
             'Retrieving releases for `%s` ...', github_slug)
+        import web
         return web.get(api_url).json()
 
     slug = github_slug.replace('/', '-')
@@ -392,6 +394,7 @@ def install_update():
     local_file = download_workflow(update_data['download_url'])
 
     wf().logger.info('Installing updated workflow ...')
+    import subprocess
     subprocess.call(['open', local_file])
 
     update_data['available'] = False
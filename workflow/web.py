@@ -10,13 +10,18 @@
 """Lightweight HTTP library with a requests-like interface."""
 
 import codecs
+from cStringIO import StringIO
+import httplib
 import json
 import mimetypes
 import os
 import random
 import re
+import select
 import socket
 import string
+import threading
+import time
 import unicodedata
 import urllib
 import urllib2
@@ -186,12 +191,18 @@ class Response(object):
 
     """
 
-    def __init__(self, request, stream=False):
+    def __init__(self, request, stream=False, opener=None,
+                 timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
         """Call `request` with :mod:`urllib2` and process results.
 
         :param request: :class:`urllib2.Request` instance
         :param stream: Whether to stream response or retrieve it all at once
         :type stream: ``bool``
+        :param opener: :class:`urllib2.OpenerDirector` to open ``request``
+            with. The globally installed opener is used by default.
+        :param timeout: connection timeout limit in seconds (only used
+            with ``opener``)
+        :type timeout: ``int``
 
         """
         self.request = request
@@ -209,7 +220,10 @@ class Response(object):
 
         # Execute query
         try:
-            self.raw = urllib2.urlopen(request)
+            if opener is None:
+                self.raw = urllib2.urlopen(request)
+            else:
+                self.raw = opener.open(request, timeout=timeout)
         except urllib2.HTTPError as err:
             self.error = err
             try:
@@ -452,6 +466,59 @@ class Response(object):
         return encoding
 
 
+def _build_request(method, url, params=None, data=None, headers=None,
+                   files=None):
+    """Create :class:`urllib2.Request`. Arguments as for :func:`request`."""
+    if not headers:
+        headers = CaseInsensitiveDictionary()
+    else:
+        headers = CaseInsensitiveDictionary(headers)
+
+    if 'user-agent' not in headers:
+        headers['user-agent'] = USER_AGENT
+
+    # Accept gzip-encoded content
+    encodings = [s.strip() for s in
+                 headers.get('accept-encoding', '').split(',')]
+    if 'gzip' not in encodings:
+        encodings.append('gzip')
+
+    headers['accept-encoding'] = ', '.join(encodings)
+
+    # Force POST by providing an empty data string
+    if method == 'POST' and not data:
+        data = ''
+
+    if files:
+        if not data:
+            data = {}
+        new_headers, data = encode_multipart_formdata(data, files)
+        headers.update(new_headers)
+    elif data and isinstance(data, dict):
+        data = urllib.urlencode(str_dict(data))
+
+    # Make sure everything is encoded text
+    headers = str_dict(headers)
+
+    if isinstance(url, unicode):
+        url = url.encode('utf-8')
+
+    if params:  # GET args (POST args are handled in encode_multipart_formdata)
+
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+
+        if query:  # Combine query string and `params`
+            url_params = urlparse.parse_qs(query)
+            # `params` take precedence over URL query string
+            url_params.update(params)
+            params = url_params
+
+        query = urllib.urlencode(str_dict(params), doseq=True)
+        url = urlparse.urlunsplit((scheme, netloc, path, query, fragment))
+
+    return urllib2.Request(url, data, headers)
+
+
 def request(method, url, params=None, data=None, headers=None, cookies=None,
             files=None, auth=None, timeout=60, allow_redirects=False,
             stream=False):
@@ -516,54 +583,7 @@ def request(method, url, params=None, data=None, headers=None, cookies=None,
     opener = urllib2.build_opener(*openers)
     urllib2.install_opener(opener)
 
-    if not headers:
-        headers = CaseInsensitiveDictionary()
-    else:
-        headers = CaseInsensitiveDictionary(headers)
-
-    if 'user-agent' not in headers:
-        headers['user-agent'] = USER_AGENT
-
-    # Accept gzip-encoded content
-    encodings = [s.strip() for s in
-                 headers.get('accept-encoding', '').split(',')]
-    if 'gzip' not in encodings:
-        encodings.append('gzip')
-
-    headers['accept-encoding'] = ', '.join(encodings)
-
-    # Force POST by providing an empty data string
-    if method == 'POST' and not data:
-        data = ''
-
-    if files:
-        if not data:
-            data = {}
-        new_headers, data = encode_multipart_formdata(data, files)
-        headers.update(new_headers)
-    elif data and isinstance(data, dict):
-        data = urllib.urlencode(str_dict(data))
-
-    # Make sure everything is encoded text
-    headers = str_dict(headers)
-
-    if isinstance(url, unicode):
-        url = url.encode('utf-8')
-
-    if params:  # GET args (POST args are handled in encode_multipart_formdata)
-
-        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
-
-        if query:  # Combine query string and `params`
-            url_params = urlparse.parse_qs(query)
-            # `params` take precedence over URL query string
-            url_params.update(params)
-            params = url_params
-
-        query = urllib.urlencode(str_dict(params), doseq=True)
-        url = urlparse.urlunsplit((scheme, netloc, path, query, fragment))
-
-    req = urllib2.Request(url, data, headers)
+    req = _build_request(method, url, params, data, headers, files)
     return Response(req, stream)
 
 
@@ -590,6 +610,247 @@ def post(url, params=None, data=None, headers=None, cookies=None, files=None,
                    timeout, allow_redirects, stream)
 
 
+def _readable(sock):
+    """Whether idle socket ``sock`` has something to read: the server
+    has closed the connection (or sent something unexpected)."""
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+class PooledHTTPHandler(urllib2.HTTPHandler, urllib2.HTTPSHandler):
+    """:mod:`urllib2` handler that sends requests over the persistent
+    connections of a :class:`Session`.
+
+    Response bodies are read in full, so the connection can go straight
+    back into the pool. HTTPS requests through a proxy (set by
+    :class:`urllib2.ProxyHandler`, e.g. from ``https_proxy``) are sent
+    through a ``CONNECT`` tunnel, pooled per proxy and destination.
+
+    """
+
+    def __init__(self, session):
+        """Create new handler for ``session``."""
+        urllib2.HTTPHandler.__init__(self)
+        urllib2.HTTPSHandler.__init__(self)
+        self.session = session
+
+    def http_open(self, req):
+        return self._open(req)
+
+    def https_open(self, req):
+        return self._open(req)
+
+    def _open(self, req):
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items()
+                       if k not in headers)
+        headers = dict((name.title(), val) for name, val in headers.items())
+        key = (req.get_type(), req.get_host(), req._tunnel_host)
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            # For the proxy, not the destination (as in urllib2)
+            tunnel_headers['Proxy-Authorization'] = headers.pop(
+                'Proxy-Authorization')
+        idempotent = req.get_method() in ('GET', 'HEAD', 'OPTIONS', 'PUT',
+                                          'DELETE')
+
+        # A pooled connection may have been closed by the server since
+        # it was last used. Retry once on a new connection if so, but
+        # don't send a POST again once it may have reached the server.
+        for attempt in range(2):
+            conn, reused = self.session._checkout(key, req.timeout,
+                                                  tunnel_headers)
+            sent = False
+            try:
+                conn.request(req.get_method(), req.get_selector(),
+                             req.data, headers)
+                sent = True
+                r = conn.getresponse()
+                body = r.read()
+            except (socket.error, httplib.HTTPException) as err:
+                conn.close()
+                if reused and not attempt and (idempotent or not sent):
+                    continue
+                raise urllib2.URLError(err)
+            break
+
+        if r.will_close:
+            conn.close()
+        else:
+            self.session._checkin(key, conn)
+
+        resp = urllib.addinfourl(StringIO(body), r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+class Session(object):
+    """Keep-alive HTTP(S) connections, pooled per host.
+
+    Use a :class:`Session` instead of the module-level :func:`request`,
+    :func:`get` and :func:`post` functions to send several requests to
+    the same hosts without a new TCP connection and TLS handshake for
+    each one. The methods take the same arguments as their module-level
+    counterparts and return :class:`Response` objects.
+
+    Python 2's :mod:`ssl` can't resume TLS sessions, so handshakes are
+    only saved by keeping connections open. Call :meth:`preconnect` to
+    open one before it is needed.
+
+    Sessions are thread-safe: each thread gets its own connection.
+
+    :param max_idle: maximum number of idle connections kept per host
+    :type max_idle: ``int``
+    :param keepalive: seconds after which an idle connection is dropped
+    :type keepalive: ``int``
+
+    """
+
+    def __init__(self, max_idle=4, keepalive=60):
+        """Create new :class:`Session` object."""
+        self.max_idle = max_idle
+        self.keepalive = keepalive
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._openers = {}
+
+    def _connect(self, key, timeout, tunnel_headers=None):
+        scheme, host, tunnel_host = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=timeout)
+        if tunnel_host:
+            conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+        return conn
+
+    def _checkout(self, key, timeout, tunnel_headers=None):
+        """Return an idle connection for ``key`` or a new one.
+
+        Idle connections the server has closed are dropped.
+
+        :param key: ``(scheme, host, tunnel_host)`` tuple. ``host`` is
+            the proxy's when tunnelling to ``tunnel_host``.
+        :type key: ``tuple``
+        :returns: ``(connection, reused)`` tuple
+        :rtype: ``tuple``
+
+        """
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if (time.time() - last_used < self.keepalive
+                        and conn.sock is not None
+                        and not _readable(conn.sock)):
+                    conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+
+        return self._connect(key, timeout, tunnel_headers), False
+
+    def _checkin(self, key, conn):
+        """Return ``conn`` to the pool."""
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def _opener(self, allow_redirects, auth=None, url=None):
+        """Return :class:`urllib2.OpenerDirector` using the pool."""
+        key = bool(allow_redirects)
+        if auth is None and key in self._openers:
+            return self._openers[key]
+
+        handlers = [PooledHTTPHandler(self)]
+        if not allow_redirects:
+            handlers.append(NoRedirectHandler())
+
+        if auth is not None:  # Add authorisation handler
+            username, password = auth
+            password_manager = urllib2.HTTPPasswordMgrWithDefaultRealm()
+            password_manager.add_password(None, url, username, password)
+            handlers.append(urllib2.HTTPBasicAuthHandler(password_manager))
+            return urllib2.build_opener(*handlers)
+
+        self._openers[key] = urllib2.build_opener(*handlers)
+        return self._openers[key]
+
+    def preconnect(self, url, timeout=60):
+        """Open a connection to the host of ``url`` and keep it in the pool.
+
+        Call this when a request to ``url`` is likely, so the TCP and TLS
+        handshakes are out of the way when it is made. Does nothing if
+        ``url`` is to be fetched through a proxy.
+
+        :param url: URL to connect to
+        :type url: ``unicode``
+        :param timeout: connection timeout limit in seconds
+        :type timeout: ``int``
+
+        """
+        scheme, host = urlparse.urlsplit(url)[:2]
+        if scheme in urllib.getproxies() and not urllib.proxy_bypass(host):
+            return
+        key = (scheme, host, None)
+        conn, reused = self._checkout(key, timeout)
+        if not reused:
+            try:
+                conn.connect()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                return
+        self._checkin(key, conn)
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, _ in idle:
+                    conn.close()
+            self._idle = {}
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                cookies=None, files=None, auth=None, timeout=60,
+                allow_redirects=False, stream=False):
+        """Initiate an HTTP(S) request. Arguments as for :func:`request`.
+
+        :returns: :class:`Response` instance
+
+        """
+        req = _build_request(method, url, params, data, headers, files)
+        return Response(req, stream,
+                        opener=self._opener(allow_redirects, auth, url),
+                        timeout=timeout)
+
+    def get(self, url, params=None, headers=None, cookies=None, auth=None,
+            timeout=60, allow_redirects=True, stream=False):
+        """Initiate a GET request. Arguments as for :func:`request`.
+
+        :returns: :class:`Response` instance
+
+        """
+        return self.request('GET', url, params, headers=headers,
+                            cookies=cookies, auth=auth, timeout=timeout,
+                            allow_redirects=allow_redirects, stream=stream)
+
+    def post(self, url, params=None, data=None, headers=None, cookies=None,
+             files=None, auth=None, timeout=60, allow_redirects=False,
+             stream=False):
+        """Initiate a POST request. Arguments as for :func:`request`.
+
+        :returns: :class:`Response` instance
+
+        """
+        return self.request('POST', url, params, data, headers, cookies,
+                            files, auth, timeout, allow_redirects, stream)
+
+
 def encode_multipart_formdata(fields, files):
     """Encode form data (``fields``) and ``files`` for POST request.
 
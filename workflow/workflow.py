@@ -21,36 +21,31 @@ up your Python script to best utilise the :class:`Workflow` object.
 
 from __future__ import print_function, unicode_literals
 
-import binascii
+# Modules that aren't needed on every run (cPickle, pickle, plistlib,
+# shutil, subprocess, unicodedata, ElementTree etc.) are imported where
+# they're used, to keep start-up fast: a script filter is started for
+# every keystroke.
 from contextlib import contextmanager
-import cPickle
-from copy import deepcopy
 import errno
+import fcntl
 import json
 import logging
 import logging.handlers
 import os
-import pickle
-import plistlib
 import re
-import shutil
 import signal
 import string
-import subprocess
 import sys
 import time
-import unicodedata
-
-try:
-    import xml.etree.cElementTree as ET
-except ImportError:  # pragma: no cover
-    import xml.etree.ElementTree as ET
 
 
 #: Sentinel for properties that haven't been set yet (that might
 #: correctly have the value ``None``)
 UNSET = object()
 
+#: Sentinel for settings deleted but not yet saved
+_DELETED = object()
+
 ####################################################################
 # Standard system icons
 ####################################################################
@@ -495,6 +490,20 @@ def isascii(text):
     return True
 
 
+def _element_tree():
+    """Return the ElementTree module, imported on first use.
+
+    :returns: :mod:`xml.etree.cElementTree` or, if it isn't available,
+        :mod:`xml.etree.ElementTree`
+
+    """
+    try:
+        import xml.etree.cElementTree as ET
+    except ImportError:  # pragma: no cover
+        import xml.etree.ElementTree as ET
+    return ET
+
+
 ####################################################################
 # Implementation classes
 ####################################################################
@@ -509,7 +518,9 @@ class SerializerManager(object):
 
     Use :meth:`register()` to register new (or replace
     existing) serializers, which you can specify by name when calling
-    :class:`Workflow` data storage methods.
+    :class:`Workflow` data storage methods. Serializers that are
+    expensive to import can be registered with :meth:`register_lazy()`
+    instead: they're only created when first requested.
 
     See :ref:`manual-serialization` and :ref:`manual-persistent-data`
     for further information.
@@ -519,6 +530,7 @@ class SerializerManager(object):
     def __init__(self):
         """Create new SerializerManager object."""
         self._serializers = {}
+        self._factories = {}
 
     def register(self, name, serializer):
         """Register ``serializer`` object under ``name``.
@@ -539,8 +551,25 @@ class SerializerManager(object):
         getattr(serializer, 'load')
         getattr(serializer, 'dump')
 
+        self._factories.pop(name, None)
         self._serializers[name] = serializer
 
+    def register_lazy(self, name, factory):
+        """Register the serializer returned by ``factory`` under ``name``.
+
+        ``factory`` is called (and its return value validated as by
+        :meth:`register()`) the first time the serializer is requested,
+        so modules it needs aren't imported until then.
+
+        :param name: Name to register serializer under
+        :type name: ``unicode`` or ``str``
+        :param factory: callable without arguments returning an object
+            with ``load()`` and ``dump()`` methods
+
+        """
+        self._serializers.pop(name, None)
+        self._factories[name] = factory
+
     def serializer(self, name):
         """Return serializer object for ``name``.
 
@@ -550,6 +579,8 @@ class SerializerManager(object):
             is registered.
 
         """
+        if name in self._factories:
+            self.register(name, self._factories[name]())
         return self._serializers.get(name)
 
     def unregister(self, name):
@@ -563,11 +594,11 @@ class SerializerManager(object):
         :returns: serializer object
 
         """
-        if name not in self._serializers:
+        serializer = self.serializer(name)
+        if serializer is None:
             raise ValueError('No such serializer registered : {0}'.format(
                              name))
 
-        serializer = self._serializers[name]
         del self._serializers[name]
 
         return serializer
@@ -575,7 +606,7 @@ class SerializerManager(object):
     @property
     def serializers(self):
         """Return names of registered serializers."""
-        return sorted(self._serializers.keys())
+        return sorted(set(self._serializers) | set(self._factories))
 
 
 class JSONSerializer(object):
@@ -640,6 +671,7 @@ class CPickleSerializer(object):
         :rtype: object
 
         """
+        import cPickle
         return cPickle.load(file_obj)
 
     @classmethod
@@ -654,6 +686,7 @@ class CPickleSerializer(object):
         :type file_obj: ``file`` object
 
         """
+        import cPickle
         return cPickle.dump(obj, file_obj, protocol=-1)
 
 
@@ -678,6 +711,7 @@ class PickleSerializer(object):
         :rtype: object
 
         """
+        import pickle
         return pickle.load(file_obj)
 
     @classmethod
@@ -692,14 +726,125 @@ class PickleSerializer(object):
         :type file_obj: ``file`` object
 
         """
+        import pickle
         return pickle.dump(obj, file_obj, protocol=-1)
 
 
+class MarshalSerializer(object):
+    """Wrapper around :mod:`marshal`, compressed with :mod:`zlib` above
+    :attr:`compress_threshold` bytes.
+
+    Faster and more compact than ``cPickle``, but only supports the
+    built-in types (``dict``, ``list``, ``unicode``, numbers etc.), and
+    the format may change between Python versions. Use it for caches.
+
+    """
+
+    #: Serialized data larger than this (in bytes) is compressed
+    compress_threshold = 4096
+
+    #: Compression level, see :func:`zlib.compress`
+    compress_level = 1
+
+    @classmethod
+    def load(cls, file_obj):
+        """Load serialized object from open marshal file.
+
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+        :returns: object loaded from marshal file
+        :rtype: object
+
+        """
+        import marshal
+        data = file_obj.read()
+        if data[:1] == b'Z':
+            import zlib
+            return marshal.loads(zlib.decompress(data[1:]))
+        return marshal.loads(data[1:])
+
+    @classmethod
+    def dump(cls, obj, file_obj):
+        """Serialize object ``obj`` to open marshal file.
+
+        :param obj: Python object to serialize
+        :type obj: built-in types only
+        :param file_obj: file handle
+        :type file_obj: ``file`` object
+
+        """
+        import marshal
+        data = marshal.dumps(obj)
+        if len(data) > cls.compress_threshold:
+            import zlib
+            file_obj.write(b'Z')
+            file_obj.write(zlib.compress(data, cls.compress_level))
+        else:
+            file_obj.write(b'M')
+            file_obj.write(data)
+
+
 # Set up default manager and register built-in serializers
 manager = SerializerManager()
 manager.register('cpickle', CPickleSerializer)
 manager.register('pickle', PickleSerializer)
 manager.register('json', JSONSerializer)
+manager.register('marshal', MarshalSerializer)
+
+#: Start of files written by :func:`dump_with_header`. No serializer
+#: output starts with a null byte.
+HEADER_MAGIC = b'\x00AWF'
+
+
+def dump_with_header(obj, file_obj, serializer_name):
+    """Serialize ``obj`` to ``file_obj``, after a header naming the
+    serializer, so :func:`load_with_header` can read it back from a
+    single file.
+
+    :param obj: Python object to serialize
+    :param file_obj: file handle
+    :type file_obj: ``file`` object
+    :param serializer_name: name of a serializer registered with
+        :data:`manager`
+    :type serializer_name: ``unicode``
+
+    """
+    serializer = manager.serializer(serializer_name)
+    if serializer is None:
+        raise ValueError(
+            'Invalid serializer `{0}`. Register your serializer with '
+            '`manager.register()` first.'.format(serializer_name))
+    file_obj.write(HEADER_MAGIC + serializer_name.encode('ascii') + b'\n')
+    serializer.dump(obj, file_obj)
+
+
+def load_with_header(file_obj, default=None):
+    """Load an object written by :func:`dump_with_header`.
+
+    Files without a header (written before there was one) are loaded
+    with serializer ``default``.
+
+    :param file_obj: file handle
+    :type file_obj: ``file`` object
+    :param default: name of serializer for files without header
+    :type default: ``unicode``
+    :returns: object loaded from file
+    :rtype: object
+
+    """
+    if file_obj.read(len(HEADER_MAGIC)) == HEADER_MAGIC:
+        serializer_name = file_obj.readline().rstrip(b'\n')
+    else:
+        file_obj.seek(0)
+        serializer_name = default
+
+    serializer = manager.serializer(serializer_name)
+    if serializer is None:
+        raise ValueError(
+            'Unknown serializer `{0}`. Register a corresponding '
+            'serializer with `manager.register()` '
+            'to load this data.'.format(serializer_name))
+    return serializer.load(file_obj)
 
 
 class Item(object):
@@ -758,6 +903,7 @@ class Item(object):
             if value:
                 attr[name] = value
 
+        ET = _element_tree()
         root = ET.Element('item', attr)
         ET.SubElement(root, 'title').text = self.title
         ET.SubElement(root, 'subtitle').text = self.subtitle
@@ -796,19 +942,92 @@ class Item(object):
 
 
 class LockFile(object):
-    """Context manager to create lock files."""
+    """Context manager to create lock files.
+
+    Uses an advisory lock (:func:`fcntl.flock`) on ``<path>.lock``, so
+    waiting doesn't poll and the lock is released by the kernel if the
+    process dies. The lock file holds the PID of its owner. One left
+    behind by a dead process (e.g. by the earlier, ``O_EXCL``-based
+    implementation) is recognised as stale and reused.
+
+    Contention is recorded in :attr:`metrics`, shared by all instances
+    in the process.
+
+    """
+
+    #: ``acquired``: locks acquired, ``contended``: ... after waiting,
+    #: ``wait``: total and ``max_wait``: longest wait in seconds,
+    #: ``stale``: stale lock files found
+    metrics = {'acquired': 0, 'contended': 0, 'wait': 0.0, 'max_wait': 0.0,
+               'stale': 0}
 
     def __init__(self, protected_path, timeout=0, delay=0.05):
-        """Create new :class:`LockFile` object."""
+        """Create new :class:`LockFile` object.
+
+        ``timeout`` (in seconds) of 0 waits as long as it takes. With a
+        ``timeout``, the lock is tried every ``delay`` seconds.
+
+        """
         self.lockfile = protected_path + '.lock'
         self.timeout = timeout
         self.delay = delay
-        self._locked = False
+        self._fd = None
 
     @property
     def locked(self):
         """`True` if file is locked by this instance."""
-        return self._locked
+        return self._fd is not None
+
+    def _open(self):
+        """Open (or create) the lock file and return its descriptor."""
+        try:
+            return os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            _create_parent(self.lockfile)
+            return os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _lock(self, fd, blocking):
+        """Lock ``fd``. Return `False` if it is locked elsewhere."""
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, flags)
+        except IOError as err:
+            if err.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        return True
+
+    def _wait(self, fd, start):
+        """Wait for the lock on ``fd``, for at most ``self.timeout``."""
+        if not self.timeout:
+            return self._lock(fd, True)
+        while time.time() - start < self.timeout:
+            time.sleep(self.delay)
+            if self._lock(fd, False):
+                return True
+        return False
+
+    def _check_stale(self, fd):
+        """Count and log a lock file left behind by a dead process."""
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            pid = int(os.read(fd, 32) or 0)
+        except ValueError:
+            return
+        if not pid or pid == os.getpid():
+            return
+        try:
+            os.kill(pid, 0)
+        except OSError as err:
+            if err.errno == errno.ESRCH:
+                LockFile.metrics['stale'] += 1
+                logging.getLogger('workflow').debug(
+                    'Stale lock file of dead process %d : %s', pid,
+                    self.lockfile)
 
     def acquire(self, blocking=True):
         """Acquire the lock if possible.
@@ -816,33 +1035,61 @@ class LockFile(object):
         If the lock is in use and ``blocking`` is ``False``, return
         ``False``.
 
-        Otherwise, check every `self.delay` seconds until it acquires
-        lock or exceeds `self.timeout` and raises an exception.
+        Otherwise, wait until the lock is released. If that takes longer
+        than ``self.timeout`` (if set), raise :class:`AcquisitionError`.
 
         """
         start = time.time()
+        contended = False
         while True:
-            try:
-                fd = os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_RDWR)
-                with os.fdopen(fd, 'w') as fd:
-                    fd.write('{0}'.format(os.getpid()))
-                break
-            except OSError as err:
-                if err.errno != errno.EEXIST:  # pragma: no cover
-                    raise
-                if self.timeout and (time.time() - start) >= self.timeout:
-                    raise AcquisitionError('Lock acquisition timed out.')
+            fd = self._open()
+            locked = self._lock(fd, False)
+            if not locked and blocking:
+                contended = True
+                locked = self._wait(fd, start)
+            if not locked:
+                os.close(fd)
                 if not blocking:
                     return False
-                time.sleep(self.delay)
-
-        self._locked = True
+                raise AcquisitionError('Lock acquisition timed out.')
+            # The previous owner may have deleted the file while we
+            # were waiting: then the lock is on a file nobody else sees.
+            try:
+                same = os.fstat(fd).st_ino == os.stat(self.lockfile).st_ino
+            except OSError:
+                same = False
+            if same:
+                break
+            os.close(fd)
+
+        self._check_stale(fd)
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, str(os.getpid()))
+        self._fd = fd
+
+        wait = time.time() - start
+        metrics = LockFile.metrics
+        metrics['acquired'] += 1
+        if contended:
+            metrics['contended'] += 1
+            metrics['wait'] += wait
+            metrics['max_wait'] = max(metrics['max_wait'], wait)
         return True
 
     def release(self):
         """Release the lock by deleting `self.lockfile`."""
-        self._locked = False
-        os.unlink(self.lockfile)
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            # Delete before unlocking, so waiting processes notice.
+            os.unlink(self.lockfile)
+        except OSError as err:  # pragma: no cover
+            if err.errno != errno.ENOENT:
+                raise
+        finally:
+            os.close(fd)  # releases the lock
 
     def __enter__(self):
         """Acquire lock."""
@@ -855,10 +1102,26 @@ class LockFile(object):
 
     def __del__(self):
         """Clear up `self.lockfile`."""
-        if self._locked:  # pragma: no cover
+        if self._fd is not None:  # pragma: no cover
             self.release()
 
 
+def _create_parent(path):
+    """Create the directory of ``path``.
+
+    :class:`Workflow` only checks its directories exist once, so the
+    writers below call this when a file can't be created (``ENOENT``):
+    the directory may have been deleted since, while the workflow kept
+    running (e.g. as a daemon).
+
+    """
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
 @contextmanager
 def atomic_writer(file_path, mode):
     """Atomic file writer.
@@ -876,7 +1139,14 @@ def atomic_writer(file_path, mode):
     """
     temp_suffix = '.aw.temp'
     temp_file_path = file_path + temp_suffix
-    with open(temp_file_path, mode) as file_obj:
+    try:
+        file_obj = open(temp_file_path, mode)
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        _create_parent(temp_file_path)
+        file_obj = open(temp_file_path, mode)
+    with file_obj:
         try:
             yield file_obj
             os.rename(temp_file_path, file_path)
@@ -961,31 +1231,125 @@ class Settings(dict):
     An appropriate instance is provided by :class:`Workflow` instances at
     :attr:`Workflow.settings`.
 
+    The file is only read when a setting is first accessed. Changes are
+    saved under a lock, merged into the current contents of the file,
+    so that concurrent processes don't overwrite each other's changes.
+    Use :meth:`batch` to save several changes at once and
+    :meth:`revalidate` to pick up changes made by other processes.
+
     """
 
     def __init__(self, filepath, defaults=None):
         """Create new :class:`Settings` object."""
         super(Settings, self).__init__()
         self._filepath = filepath
-        self._nosave = False
+        self._defaults = defaults
+        self._loaded = False
+        self._stat = None
         self._original = {}
+        # Unsaved changes: key -> value or `_DELETED`
+        self._changes = {}
+        self._batch = 0
+
+    def _ensure_loaded(self):
+        """Load settings on first access."""
+        if self._loaded:
+            return
+        self._loaded = True
         if os.path.exists(self._filepath):
             self._load()
-        elif defaults:
-            for key, val in defaults.items():
-                self[key] = val
-            self.save()  # save default settings
+        elif self._defaults:
+            with self.batch():
+                for key, val in self._defaults.items():
+                    self[key] = val  # save default settings
+
+    def _read(self):
+        """Read the settings file.
+
+        :returns: ``(settings, original, stat)``: the settings, a copy
+            of them to detect changes to mutable values, and the
+            ``(mtime, size, inode)`` of the file. Empty and ``None`` if
+            the file doesn't exist.
+
+        """
+        try:
+            with open(self._filepath, 'rb') as file_obj:
+                st = os.fstat(file_obj.fileno())
+                raw = file_obj.read()
+        except IOError as err:
+            if err.errno != errno.ENOENT:  # pragma: no cover
+                raise
+            return {}, {}, None
+        # Parsing twice is much faster than `copy.deepcopy`
+        return (json.loads(raw, encoding='utf-8'),
+                json.loads(raw, encoding='utf-8'),
+                (st.st_mtime, st.st_size, st.st_ino))
 
     def _load(self):
         """Load cached settings from JSON file `self._filepath`."""
-        self._nosave = True
-        d = {}
-        with open(self._filepath, 'rb') as file_obj:
-            for key, value in json.load(file_obj, encoding='utf-8').items():
-                d[key] = value
-        self.update(d)
-        self._original = deepcopy(d)
-        self._nosave = False
+        data, self._original, self._stat = self._read()
+        dict.clear(self)
+        dict.update(self, data)
+        # Unsaved changes (in a batch) still apply
+        self._apply(self._changes)
+
+    def _apply(self, changes):
+        for key, value in changes.items():
+            if value is _DELETED:
+                dict.pop(self, key, None)
+            else:
+                dict.__setitem__(self, key, value)
+
+    def revalidate(self):
+        """Reload settings if the file has changed since it was read.
+
+        Costs one ``stat``. Long-lived processes should call this
+        before using settings that other processes may have changed.
+
+        :returns: ``True`` if the settings were reloaded
+        :rtype: ``bool``
+
+        """
+        if not self._loaded:
+            return False
+        try:
+            st = os.stat(self._filepath)
+            stat = (st.st_mtime, st.st_size, st.st_ino)
+        except OSError:
+            stat = None
+        if stat == self._stat:
+            return False
+        self._load()
+        return True
+
+    @contextmanager
+    def batch(self):
+        """Context manager that saves all changes made in it at once.
+
+        Batches may be nested: changes are saved when the outermost one
+        ends. If it ends with an exception, the changes are discarded.
+
+        """
+        self._ensure_loaded()
+        self._batch += 1
+        try:
+            yield self
+        except Exception:
+            self._batch -= 1
+            if not self._batch:
+                self._changes.clear()
+                self._load()
+            raise
+        else:
+            self._batch -= 1
+            if not self._batch and self._changes:
+                self.save()
+
+    def _changed(self, key, value):
+        """Record a change and save it unless in a batch."""
+        self._changes[key] = value
+        if not self._batch:
+            self.save()
 
     @uninterruptible
     def save(self):
@@ -994,40 +1358,123 @@ class Settings(dict):
         If you're using this class via :attr:`Workflow.settings`, which
         you probably are, ``self._filepath`` will be ``settings.json``
         in your workflow's data directory (see :attr:`~Workflow.datadir`).
+
+        The file is read again under the lock and the unsaved changes
+        are applied to its current contents.
         """
-        if self._nosave:
-            return
-        data = {}
-        data.update(self)
-        # for key, value in self.items():
-        #     data[key] = value
+        self._ensure_loaded()
         with LockFile(self._filepath):
+            if self._changes:
+                data, _, _ = self._read()
+                changes, self._changes = self._changes, {}
+                dict.clear(self)
+                dict.update(self, data)
+                self._apply(changes)
+            text = json.dumps(dict(self), sort_keys=True, indent=2,
+                              encoding='utf-8')
             with atomic_writer(self._filepath, 'wb') as file_obj:
-                json.dump(data, file_obj, sort_keys=True, indent=2,
-                          encoding='utf-8')
+                file_obj.write(text)
+            st = os.stat(self._filepath)
+        self._stat = (st.st_mtime, st.st_size, st.st_ino)
+        self._original = json.loads(text, encoding='utf-8')
 
     # dict methods
+    def __getitem__(self, key):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).__getitem__(key)
+
+    def __contains__(self, key):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).__contains__(key)
+
+    def __iter__(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).__iter__()
+
+    def __len__(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).__len__()
+
+    def __repr__(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).__repr__()
+
+    def get(self, key, default=None):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).get(key, default)
+
+    def has_key(self, key):
+        """Implement :class:`dict` interface."""
+        return key in self
+
+    def keys(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).keys()
+
+    def values(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).values()
+
+    def items(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).items()
+
+    def iterkeys(self):
+        """Implement :class:`dict` interface."""
+        return iter(self)
+
+    def itervalues(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).itervalues()
+
+    def iteritems(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).iteritems()
+
+    def copy(self):
+        """Implement :class:`dict` interface."""
+        self._ensure_loaded()
+        return super(Settings, self).copy()
+
     def __setitem__(self, key, value):
         """Implement :class:`dict` interface."""
-        if self._original.get(key) != value:
-            super(Settings, self).__setitem__(key, value)
-            self.save()
+        self._ensure_loaded()
+        if key in self._original and self._original[key] == value:
+            if key in self._changes:  # changed back in this batch
+                super(Settings, self).__setitem__(key, value)
+                self._changed(key, value)
+            return
+        super(Settings, self).__setitem__(key, value)
+        self._changed(key, value)
 
     def __delitem__(self, key):
         """Implement :class:`dict` interface."""
+        self._ensure_loaded()
         super(Settings, self).__delitem__(key)
-        self.save()
+        self._changed(key, _DELETED)
 
     def update(self, *args, **kwargs):
         """Override :class:`dict` method to save on update."""
-        super(Settings, self).update(*args, **kwargs)
-        self.save()
+        with self.batch():
+            for key, value in dict(*args, **kwargs).items():
+                self[key] = value
 
     def setdefault(self, key, value=None):
         """Override :class:`dict` method to save on update."""
-        ret = super(Settings, self).setdefault(key, value)
-        self.save()
-        return ret
+        if key not in self:
+            self[key] = value
+        return self[key]
 
 
 class Workflow(object):
@@ -1083,6 +1530,9 @@ class Workflow(object):
         self._capture_args = capture_args
         self.help_url = help_url
         self._workflowdir = None
+        self._cachedir = None
+        self._datadir = None
+        self._created_dirs = set()
         self._settings_path = None
         self._settings = None
         self._bundleid = None
@@ -1300,11 +1750,12 @@ class Workflow(object):
 
             # `version` file
             if not version:
-                filepath = self.workflowfile('version')
-
-                if os.path.exists(filepath):
-                    with open(filepath, 'rb') as fileobj:
+                try:
+                    with open(self.workflowfile('version'), 'rb') as fileobj:
                         version = fileobj.read()
+                except IOError as err:
+                    if err.errno != errno.ENOENT:
+                        raise
 
             # info.plist
             if not version:
@@ -1367,17 +1818,22 @@ class Workflow(object):
 
         ``Alfred-X`` may be ``Alfred-2`` or ``Alfred-3``.
 
+        The directory is created on first access.
+
         :returns: full path to workflow's cache directory
         :rtype: ``unicode``
 
         """
-        if self.alfred_env.get('workflow_cache'):
-            dirpath = self.alfred_env.get('workflow_cache')
+        if not self._cachedir:
+            if self.alfred_env.get('workflow_cache'):
+                dirpath = self.alfred_env.get('workflow_cache')
 
-        else:
-            dirpath = self._default_cachedir
+            else:
+                dirpath = self._default_cachedir
+
+            self._cachedir = self._create(dirpath)
 
-        return self._create(dirpath)
+        return self._cachedir
 
     @property
     def _default_cachedir(self):
@@ -1397,17 +1853,22 @@ class Workflow(object):
 
         ``~/Library/Application Support/Alfred 2/Workflow Data/<bundle id>``
 
+        The directory is created on first access.
+
         :returns: full path to workflow data directory
         :rtype: ``unicode``
 
         """
-        if self.alfred_env.get('workflow_data'):
-            dirpath = self.alfred_env.get('workflow_data')
+        if not self._datadir:
+            if self.alfred_env.get('workflow_data'):
+                dirpath = self.alfred_env.get('workflow_data')
 
-        else:
-            dirpath = self._default_datadir
+            else:
+                dirpath = self._default_datadir
 
-        return self._create(dirpath)
+            self._datadir = self._create(dirpath)
+
+        return self._datadir
 
     @property
     def _default_datadir(self):
@@ -1591,7 +2052,7 @@ class Workflow(object):
         :rtype: :class:`~workflow.workflow.Settings` instance
 
         """
-        if not self._settings:
+        if self._settings is None:
             self.logger.debug('Reading settings from `{0}` ...'.format(
                               self.settings_path))
             self._settings = Settings(self.settings_path,
@@ -1694,6 +2155,29 @@ class Workflow(object):
 
         :param name: name of datastore
 
+        """
+        try:
+            file_obj = open(self.datafile('{0}.store'.format(name)), 'rb')
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return self._stored_data_legacy(name)
+
+        with file_obj:
+            data = load_with_header(file_obj)
+
+        self.logger.debug('Stored data loaded from : {0}'.format(
+            file_obj.name))
+
+        return data
+
+    def _stored_data_legacy(self, name):
+        """Retrieve data stored in the format before :meth:`store_data`
+        wrote a single file: a metadata file with the serializer's name
+        and the data file.
+
+        :param name: name of datastore
+
         """
         metadata_path = self.datafile('.{0}.alfred-workflow'.format(name))
 
@@ -1704,29 +2188,15 @@ class Workflow(object):
         with open(metadata_path, 'rb') as file_obj:
             serializer_name = file_obj.read().strip()
 
-        serializer = manager.serializer(serializer_name)
-
-        if serializer is None:
-            raise ValueError(
-                'Unknown serializer `{0}`. Register a corresponding '
-                'serializer with `manager.register()` '
-                'to load this data.'.format(serializer_name))
-
-        self.logger.debug('Data `{0}` stored in `{1}` format'.format(
-            name, serializer_name))
-
-        filename = '{0}.{1}'.format(name, serializer_name)
-        data_path = self.datafile(filename)
+        data_path = self.datafile('{0}.{1}'.format(name, serializer_name))
 
         if not os.path.exists(data_path):
             self.logger.debug('No data stored for `{0}`'.format(name))
-            if os.path.exists(metadata_path):
-                os.unlink(metadata_path)
-
+            os.unlink(metadata_path)
             return None
 
         with open(data_path, 'rb') as file_obj:
-            data = serializer.load(file_obj)
+            data = load_with_header(file_obj, serializer_name)
 
         self.logger.debug('Stored data loaded from : {0}'.format(data_path))
 
@@ -1761,71 +2231,84 @@ class Workflow(object):
 
         serializer_name = serializer or self.data_serializer
 
-        # In order for `stored_data()` to be able to load data stored with
-        # an arbitrary serializer, yet still have meaningful file extensions,
-        # the format (i.e. extension) is saved to an accompanying file
-        metadata_path = self.datafile('.{0}.alfred-workflow'.format(name))
-        filename = '{0}.{1}'.format(name, serializer_name)
-        data_path = self.datafile(filename)
-
-        if data_path == self.settings_path:
-            raise ValueError(
-                'Cannot save data to' +
-                '`{0}` with format `{1}`. '.format(name, serializer_name) +
-                "This would overwrite Alfred-Workflow's settings file.")
-
-        serializer = manager.serializer(serializer_name)
+        # The data file starts with the serializer's name, so
+        # `stored_data()` can load data stored with any serializer
+        data_path = self.datafile('{0}.store'.format(name))
 
-        if serializer is None:
+        if manager.serializer(serializer_name) is None:
             raise ValueError(
                 'Invalid serializer `{0}`. Register your serializer with '
                 '`manager.register()` first.'.format(serializer_name))
 
+        # Data stored in the old format: a metadata file naming the
+        # serializer, and the data file
+        metadata_path = self.datafile('.{0}.alfred-workflow'.format(name))
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'rb') as file_obj:
+                legacy_path = self.datafile('{0}.{1}'.format(
+                    name, file_obj.read().strip()))
+            delete_paths((metadata_path, legacy_path))
+
         if data is None:  # Delete cached data
-            delete_paths((metadata_path, data_path))
+            delete_paths((data_path,))
             return
 
         # Ensure write is not interrupted by SIGTERM
         @uninterruptible
         def _store():
-            # Save file extension
-            with atomic_writer(metadata_path, 'wb') as file_obj:
-                file_obj.write(serializer_name)
-
             with atomic_writer(data_path, 'wb') as file_obj:
-                serializer.dump(data, file_obj)
+                dump_with_header(data, file_obj, serializer_name)
 
         _store()
 
         self.logger.debug('Stored data saved at : {0}'.format(data_path))
 
-    def cached_data(self, name, data_func=None, max_age=60):
+    def cached_data(self, name, data_func=None, max_age=60,
+                    max_stale_age=0, refresh=None):
         """Return cached data if younger than ``max_age`` seconds.
 
         Retrieve data from cache or re-generate and re-cache data if
         stale/non-existant. If ``max_age`` is 0, return cached data no
         matter how old.
 
+        If ``max_stale_age`` and ``refresh`` are set, stale data younger
+        than ``max_stale_age`` seconds is returned straight away, and the
+        ``refresh`` command is run in the background to re-cache it
+        (stale-while-revalidate). Only data older than that is
+        re-generated with ``data_func``.
+
         :param name: name of datastore
         :param data_func: function to (re-)generate data.
         :type data_func: ``callable``
         :param max_age: maximum age of cached data in seconds
         :type max_age: ``int``
+        :param max_stale_age: maximum age of stale data in seconds
+        :type max_stale_age: ``int``
+        :param refresh: command that re-caches the data, as passed to
+            :func:`~workflow.background.run_in_background`
+        :type refresh: ``list``
         :returns: cached data, return value of ``data_func`` or ``None``
             if ``data_func`` is not set
 
         """
-        serializer = manager.serializer(self.cache_serializer)
-
         cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
-        age = self.cached_data_age(name)
+        file_obj, age = self._open_cache_file(cache_path)
+
+        if file_obj:
+            with file_obj:
+                if age < max_age or max_age == 0:
+                    self.logger.debug('Loading cached data from : %s',
+                                      cache_path)
+                    return load_with_header(file_obj, self.cache_serializer)
 
-        if (age < max_age or max_age == 0) and os.path.exists(cache_path):
+                if max_stale_age and refresh and age < max_stale_age:
+                    from background import run_in_background
+                    run_in_background('__workflow_refresh_%s' % name,
+                                      refresh)
 
-            with open(cache_path, 'rb') as file_obj:
-                self.logger.debug('Loading cached data from : %s',
-                                  cache_path)
-                return serializer.load(file_obj)
+                    self.logger.debug('Loading stale data from : %s',
+                                      cache_path)
+                    return load_with_header(file_obj, self.cache_serializer)
 
         if not data_func:
             return None
@@ -1846,8 +2329,6 @@ class Workflow(object):
                 the cache serializer
 
         """
-        serializer = manager.serializer(self.cache_serializer)
-
         cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
 
         if data is None:
@@ -1857,7 +2338,7 @@ class Workflow(object):
             return
 
         with atomic_writer(cache_path, 'wb') as file_obj:
-            serializer.dump(data, file_obj)
+            dump_with_header(data, file_obj, self.cache_serializer)
 
         self.logger.debug('Cached data saved at : %s', cache_path)
 
@@ -1889,10 +2370,34 @@ class Workflow(object):
         """
         cache_path = self.cachefile('%s.%s' % (name, self.cache_serializer))
 
-        if not os.path.exists(cache_path):
+        try:
+            return time.time() - os.stat(cache_path).st_mtime
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
             return 0
 
-        return time.time() - os.stat(cache_path).st_mtime
+    def _open_cache_file(self, cache_path):
+        """Open ``cache_path`` for reading and return its age.
+
+        Checking the age of the open file (instead of the path) takes
+        a single ``open`` and ``fstat``.
+
+        :param cache_path: path to cache file
+        :type cache_path: ``unicode``
+        :returns: ``(file_obj, age)`` tuple or ``(None, 0)`` if the
+            cache file doesn't exist
+        :rtype: ``tuple``
+
+        """
+        try:
+            file_obj = open(cache_path, 'rb')
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return None, 0
+
+        return file_obj, time.time() - os.fstat(file_obj.fileno()).st_mtime
 
     def filter(self, query, items, key=lambda x: x, ascending=False,
                include_score=False, min_score=0, max_results=0,
@@ -2307,6 +2812,7 @@ class Workflow(object):
 
     def send_feedback(self):
         """Print stored items to console/Alfred as XML."""
+        ET = _element_tree()
         root = ET.Element('items')
         for item in self._items:
             root.append(item.elem)
@@ -2588,6 +3094,7 @@ class Workflow(object):
             h = groups.get('hex')
             password = groups.get('pw')
             if h:
+                import binascii
                 password = unicode(binascii.unhexlify(h), 'utf-8')
 
         self.logger.debug('Got password : %s:%s', service, account)
@@ -2771,27 +3278,33 @@ class Workflow(object):
 
     def open_log(self):
         """Open :attr:`logfile` in default app (usually Console.app)."""
+        import subprocess
         subprocess.call(['open', self.logfile])
 
     def open_cachedir(self):
         """Open the workflow's :attr:`cachedir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.cachedir])
 
     def open_datadir(self):
         """Open the workflow's :attr:`datadir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.datadir])
 
     def open_workflowdir(self):
         """Open the workflow's :attr:`workflowdir` in Finder."""
+        import subprocess
         subprocess.call(['open', self.workflowdir])
 
     def open_terminal(self):
         """Open a Terminal window at workflow's :attr:`workflowdir`."""
+        import subprocess
         subprocess.call(['open', '-a', 'Terminal',
                         self.workflowdir])
 
     def open_help(self):
         """Open :attr:`help_url` in default browser."""
+        import subprocess
         subprocess.call(['open', self.help_url])
 
         return 'Opening workflow help URL in browser'
@@ -2832,6 +3345,7 @@ class Workflow(object):
         normalization = normalization or self._normalizsation
         if not isinstance(text, unicode):
             text = unicode(text, encoding)
+        import unicodedata
         return unicodedata.normalize(normalization, text)
 
     def fold_to_ascii(self, text):
@@ -2850,6 +3364,7 @@ class Workflow(object):
         if isascii(text):
             return text
         text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
+        import unicodedata
         return unicode(unicodedata.normalize('NFKD',
                        text).encode('ascii', 'ignore'))
 
@@ -2890,6 +3405,7 @@ class Workflow(object):
                     continue
                 path = os.path.join(dirpath, filename)
                 if os.path.isdir(path):
+                    import shutil
                     shutil.rmtree(path)
                 else:
                     os.unlink(path)
@@ -2898,20 +3414,26 @@ class Workflow(object):
     def _load_info_plist(self):
         """Load workflow info from ``info.plist``."""
         # info.plist should be in the directory above this one
+        import plistlib
         self._info = plistlib.readPlist(self.workflowfile('info.plist'))
         self._info_loaded = True
 
     def _create(self, dirpath):
         """Create directory `dirpath` if it doesn't exist.
 
+        Each directory is only checked once per instance. Writers
+        create it again if it has been deleted since.
+
         :param dirpath: path to directory
         :type dirpath: ``unicode``
         :returns: ``dirpath`` argument
         :rtype: ``unicode``
 
         """
-        if not os.path.exists(dirpath):
-            os.makedirs(dirpath)
+        if dirpath not in self._created_dirs:
+            if not os.path.exists(dirpath):
+                os.makedirs(dirpath)
+            self._created_dirs.add(dirpath)
         return dirpath
 
     def _call_security(self, action, service, account, *args):
@@ -2938,6 +3460,7 @@ class Workflow(object):
         :rtype: `tuple` (`int`, ``unicode``)
 
         """
+        import subprocess
         cmd = ['security', action, '-s', service, '-a', account] + list(args)
         p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                              stderr=subprocess.STDOUT)